@@ -56,7 +56,7 @@ async def cabinet_start(message: types.Message, state: FSMContext):
         await message.answer(text, reply_markup=keyboard)
         return
 
-    user_info = get_user(token)
+    user_info = await get_user(token)
 
     if user_info is None:
         await message.answer('<b>Ошибка.</b> Не удалось загрузить пользовательские данные.')
@@ -91,7 +91,7 @@ async def cabinet_main_menu(message: types.Message, state: FSMContext):
         else:
             mode = 'reserve'
 
-        tickets = get_tickets(token, mode)
+        tickets = await get_tickets(token, mode)
 
         if tickets is None:
             await message.answer('<b>Ошибка.</b> Не удалось загрузить список заявок.')
@@ -119,7 +119,7 @@ async def cabinet_main_menu(message: types.Message, state: FSMContext):
             await message.answer('<b>Ошибка</b>. Не удалось загрузить информацию профиля.')
             return
 
-        archive = get_tickets(token, 'archive')
+        archive = await get_tickets(token, 'archive')
         archive.sort(key=lambda x: x['date'], reverse=True)
 
         merged_trips = {}
@@ -153,6 +153,7 @@ async def cabinet_main_menu(message: types.Message, state: FSMContext):
     if message.text.lower() == 'выход из профиля':
         user_data = await state.get_data()
         user_data.pop('token', None)
+        user_data.pop('fio', None)
         await state.set_data(user_data)
 
         await cabinet_start(message, state)
@@ -174,7 +175,7 @@ async def cabinet_last_name(message: types.Message, state: FSMContext):
         await message.answer('<b>Ошибка.</b> Не удалось загрузить информацию профиля.')
         return
 
-    update_data = update_last_name(message.text, token)
+    update_data = await update_last_name(message.text, token)
 
     if update_data is None:
         await message.answer('<b>Ошибка.</b> Не удалось обработать ответ сервера.')
@@ -184,6 +185,7 @@ async def cabinet_last_name(message: types.Message, state: FSMContext):
         await message.answer(f'<b>Ошибка.</b> {update_data["error"]}')
         return
 
+    await state.update_data(fio=message.text)
     await message.answer('Фамилия изменена.')
     await cabinet_start(message, state)
     return
@@ -212,7 +214,7 @@ async def cabinet_archive(message: types.Message, state: FSMContext):
                 await message.answer('<b>Ошибка</b>. Не удалось загрузить информацию профиля.')
                 return
 
-            archive = get_tickets(token, 'archive')
+            archive = await get_tickets(token, 'archive')
             archive.sort(key=lambda x: x['date'])
 
             for t in archive:
@@ -237,7 +239,7 @@ async def contact_sent(message: types.Message, state: FSMContext):
         return
 
     phone = message.contact.phone_number.replace('+', '')
-    confirm_id = send_code(phone)
+    confirm_id = await send_code(phone)
 
     if confirm_id is None:
         await message.answer('<b>Ошибка.</b> Не удалось отправить SMS с кодом.')
@@ -257,7 +259,7 @@ async def code_sent(message: types.Message, state: FSMContext):
         return
 
     user_data = await state.get_data()
-    confirm_data = check_code(user_data['confirm_id'], message.text.strip())
+    confirm_data = await check_code(user_data['confirm_id'], message.text.strip())
 
     if confirm_data is None:
         await message.answer('<b>Ошибка.</b> Не удалось проверить код авторизации.')
@@ -300,7 +302,7 @@ async def callback_cancel_ticket(query: types.CallbackQuery, callback_data: dict
             await query.message.edit_reply_markup(None)
             return
 
-        cancel_data = cancel_trip(callback_data['type'], callback_data['id'], token)
+        cancel_data = await cancel_trip(callback_data['type'], callback_data['id'], token)
 
         if cancel_data is None:
             await query.answer('Ошибка. Возникла проблема при отправке запроса.', show_alert=True)
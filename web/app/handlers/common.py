@@ -4,8 +4,9 @@ from aiogram.utils.callback_data import CallbackData
 
 from ..handlers.trip_search import TripSearch, start_trip_search
 from ..handlers.cabinet import cabinet_start
-from ..utils.dbworker import get_user_trips, update_trip, get_stats, get_user_dates, delete_record
+from ..utils.async_db import get_user_trips, update_trip, get_stats, get_user_dates, delete_record
 from ..messages.formatter import parse_favourite, parse_favourite_date
+from ..utils.availability import availability
 
 unfollow_cb = CallbackData('unfollow', 'id', 'confirm')
 
@@ -33,8 +34,8 @@ async def cmd_start(message: types.Message, state: FSMContext):
 
 
 async def cmd_following(message: types.Message):
-    trips = get_user_trips(message.chat.id, active=True)
-    dates = get_user_dates(message.chat.id)
+    trips = await get_user_trips(message.chat.id, active=True)
+    dates = await get_user_dates(message.chat.id)
 
     if len(dates) == 0 and len(trips) == 0:
         await message.answer('Отслеживаемые рейсы и даты не найдены.')
@@ -88,11 +89,11 @@ async def callback_unfollow(query: types.CallbackQuery, callback_data: dict):
                                       f"<b>Ты точно хочешь удалить рейс из отслеживаемых?</b>", reply_markup=keyboard)
 
     elif callback_data['confirm'] == 'yes':
-        update_trip(callback_data['id'], False)
+        await update_trip(callback_data['id'], False)
         await query.message.edit_text('Рейс удален из отслеживаемых.', reply_markup=None)
 
     elif callback_data['confirm'] == 'date':  # without confirmation
-        delete_record(callback_data['id'])
+        await delete_record(callback_data['id'])
         await query.message.edit_text('Дата удалена из отслеживаемых.', reply_markup=None)
 
     elif callback_data['confirm'] == 'cancel':
@@ -106,8 +107,10 @@ async def callback_unfollow(query: types.CallbackQuery, callback_data: dict):
 
 
 async def get_bot_stats(message: types.Message):
-    unique_users, active_followings = get_stats()
-    await message.answer(f"<b>Активных отслеживаний:</b> {active_followings}\n<b>Пользователей:</b> {unique_users}")
+    unique_users, active_followings = await get_stats()
+    await message.answer(f"<b>Активных отслеживаний:</b> {active_followings}\n<b>Пользователей:</b> {unique_users}\n"
+                         f"<b>Попаданий в кэш рейсов:</b> {availability.hit_ratio:.0%} "
+                         f"({availability.hits} из {availability.hits + availability.misses})")
 
 
 async def default_handler(message: types.Message, state: FSMContext):
@@ -0,0 +1,54 @@
+from aiogram import Dispatcher, types
+
+from ..utils.availability import availability
+from ..utils.catalog import routes
+from ..utils.date_strings import parse_date_string, generate_readable_date
+from ..messages.formatter import parse_trips_info
+
+
+async def inline_search(query: types.InlineQuery, cache_time: int):
+    # answered from the availability cache only, so the results keep up with typing
+    if await routes.get_directions() is None:
+        return
+
+    found = routes.find(query.query)
+    parsed_date = None if found is None else parse_date_string(found[1].lower() or 'сегодня')
+
+    if parsed_date is None:
+        await query.answer([], cache_time=cache_time, switch_pm_text='Пример запроса: Минск Гродно завтра',
+                           switch_pm_parameter='find')
+        return
+
+    departure, destination = found[0]
+    snapshot = availability.peek(parsed_date, departure, destination)
+
+    if snapshot is None:
+        await query.answer([], cache_time=1, switch_pm_text='Рейсы загружаются, повтори запрос',
+                           switch_pm_parameter='find')
+        return
+
+    direction = f"{departure} – {destination}"
+    results = []
+
+    for time, trips in sorted(snapshot.by_time.items()):
+        for msg in parse_trips_info(trips, direction):
+            results.append(types.InlineQueryResultArticle(
+                id=f"{parsed_date}_{time}_{msg['id']}",
+                title=f"{time}, свободных мест: {msg['places']}",
+                description=f"{direction}, {generate_readable_date(parsed_date)}",
+                input_message_content=types.InputTextMessageContent(msg['message'], parse_mode='HTML')
+            ))
+
+    if not results:
+        await query.answer([], cache_time=cache_time, switch_pm_text='Рейсы на эту дату не найдены',
+                           switch_pm_parameter='find')
+        return
+
+    await query.answer(results[:50], cache_time=cache_time)
+
+
+def register_handlers_inline(dp: Dispatcher, cache_time: int):
+    async def handler(query: types.InlineQuery):
+        await inline_search(query, cache_time)
+
+    dp.register_inline_handler(handler, state='*')
@@ -1,16 +1,21 @@
+import asyncio
+
 from aiogram import Dispatcher, types
 from aiogram.dispatcher import FSMContext
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.utils.callback_data import CallbackData
 
 from .cabinet import get_token
-from ..utils.data_requests import get_directions, get_trips, create_reserve, get_stations, create_booking
+from ..utils.data_requests import create_reserve, create_booking, get_user
+from ..utils.availability import availability
+from ..utils.catalog import routes, station_catalog
 from ..utils.date_strings import *
-from ..messages.formatter import parse_trips_info
-from ..utils.actions import Action
-from ..utils.dbworker import create_trip, get_user_trips, update_trip, get_user_dates, create_user_date
+from ..messages.formatter import parse_trips_info, parse_snapshot_age, parse_range_summary
+from ..utils.actions import Action, request_cb
+from ..utils.async_db import create_trip, get_user_trips, update_trip, get_user_dates, create_user_date, \
+    set_trip_station
 
-request_cb = CallbackData('do', 'action', 'departure', 'destination', 'date', 'time', 'id', 'places', sep='|')
+auto_cb = CallbackData('auto', 'id', 'station')
 
 
 class TripSearch(StatesGroup):
@@ -29,7 +34,7 @@ async def start_trip_search(message: types.Message, state: FSMContext):
 
     await state.set_data(user_data)
 
-    directions = get_directions()
+    directions = await routes.get_directions()
 
     if directions is None:
         await message.answer('<b>Ошибка.</b> Не удалось загрузить список доступных маршрутов.')
@@ -43,9 +48,13 @@ async def start_trip_search(message: types.Message, state: FSMContext):
 
 
 async def direction_chosen(message: types.Message, state: FSMContext):
-    directions = get_directions()
+    directions = await routes.get_directions()
 
-    if message.text not in directions:
+    if directions is None:
+        await message.answer('<b>Ошибка.</b> Не удалось загрузить список доступных маршрутов.')
+        return
+
+    if message.text not in routes:
         keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=2,
                                              input_field_placeholder='Выбор маршрута')
         keyboard.add(*directions)
@@ -53,14 +62,17 @@ async def direction_chosen(message: types.Message, state: FSMContext):
         await message.answer('Указанный маршрут не найден.', reply_markup=keyboard)
         return
 
-    departure, destination = message.text.split(" – ", maxsplit=1)
+    departure, destination = routes.lookup(message.text)
 
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, row_width=1, input_field_placeholder='Дата поездки')
     keyboard.row('сегодня', 'завтра')
+    keyboard.row('ближайшие 7 дней')
     keyboard.add(*generate_date_strings(offset=2, length=13), 'Назад')
 
     text = 'Выбери дату поездки из списка или введи вручную в одном из следующих форматов:\n' \
-           '<em>ДД.ММ.ГГГГ, ДД/ММ/ГГГГ, ДД-ММ-ГГГГ.</em>\n\nЕсли на указанную дату бронирование ещё не началось, ' \
+           '<em>ДД.ММ.ГГГГ, ДД/ММ/ГГГГ, ДД-ММ-ГГГГ.</em>\n\nЧтобы увидеть свободные места сразу на несколько дней, ' \
+           'введи <em>N дней</em> или <em>N дней ЧЧ:ММ-ЧЧ:ММ</em> (не более 14 дней).\n\n' \
+           'Если на указанную дату бронирование ещё не началось, ' \
            'можно включить <b>отслеживание даты</b>, и как только бронирование откроется, ты получишь уведомление ' \
            '<em>(работает с датами, до которых не более 30 дней)</em>.'
 
@@ -79,6 +91,12 @@ async def date_chosen(message: types.Message, state: FSMContext):
         await start_trip_search(message, state)
         return
 
+    date_range = parse_date_range(message.text.lower())
+
+    if date_range is not None:
+        await range_chosen(message, state, *date_range)
+        return
+
     parsed_date = parse_date_string(message.text.lower())
 
     if parsed_date is None:
@@ -86,12 +104,15 @@ async def date_chosen(message: types.Message, state: FSMContext):
 
     user_data = await state.get_data()
 
-    trips = get_trips(parsed_date, user_data['departure'], user_data['destination'])
+    snapshot = await availability.search(parsed_date, user_data['departure'], user_data['destination'])
 
-    if trips is None:
+    if snapshot is None:
         await message.answer('<b>Ошибка.</b> Не удалось загрузить список рейсов.')
         return
 
+    trips = snapshot.trips
+    age_note = parse_snapshot_age(snapshot.age) if availability.is_stale(snapshot) else ''
+
     if len(trips) == 0:
         keyboard = types.InlineKeyboardMarkup()
         button_data = request_cb.new(
@@ -104,7 +125,7 @@ async def date_chosen(message: types.Message, state: FSMContext):
             places='-'
         )
         keyboard.add(types.InlineKeyboardButton('Отслеживать дату', callback_data=button_data))
-        await message.answer('В выбранный день рейсы не найдены.', reply_markup=keyboard)
+        await message.answer(f'В выбранный день рейсы не найдены.{age_note}', reply_markup=keyboard)
         return
 
     merged_trips = {}
@@ -118,7 +139,21 @@ async def date_chosen(message: types.Message, state: FSMContext):
 
     await state.update_data(date=parsed_date)
     await TripSearch.time.set()
-    await message.answer('Выбери время поездки.', reply_markup=keyboard)
+    await message.answer('Выбери время поездки. Чтобы отслеживать сразу все рейсы в промежутке времени, введи его '
+                         f'в формате <em>ЧЧ:ММ-ЧЧ:ММ</em>.{age_note}', reply_markup=keyboard)
+
+
+async def range_chosen(message: types.Message, state: FSMContext, dates, window):
+    user_data = await state.get_data()
+
+    # all days are requested at once, cached ones are answered without going upstream
+    snapshots = await asyncio.gather(*[availability.search(d, user_data['departure'], user_data['destination'])
+                                       for d in dates])
+
+    days = [(d, None if s is None else s.trips) for d, s in zip(dates, snapshots)]
+    text = parse_range_summary(f"{user_data['departure']} – {user_data['destination']}", days, window)
+
+    await message.answer(f"{text}\nВыбери дату, чтобы посмотреть рейсы.")
 
 
 async def time_chosen(message: types.Message, state: FSMContext):
@@ -133,12 +168,25 @@ async def time_chosen(message: types.Message, state: FSMContext):
         await direction_chosen(message, state)
         return
 
+    window = parse_time_window(message.text)
+
+    if window is not None:
+        await window_chosen(message, state, *window)
+        return
+
     parsed_time = message.text.split(' ', maxsplit=1)[0]
     if not re.match(r'^([0-1]?[0-9]|2[0-3]):[0-5][0-9]$', parsed_time):
         return None
 
     user_data = await state.get_data()
-    trips = get_trips(user_data['date'], user_data['departure'], user_data['destination'], parsed_time)
+    snapshot = await availability.search(user_data['date'], user_data['departure'], user_data['destination'])
+
+    if snapshot is None:
+        await message.answer('<b>Ошибка.</b> Не удалось загрузить список рейсов.')
+        return
+
+    trips = snapshot.by_time.get(parsed_time, [])
+    age_note = parse_snapshot_age(snapshot.age) if availability.is_stale(snapshot) else ''
 
     if len(trips) == 0:
         await message.answer('На выбранное время рейсы не найдены.')
@@ -161,14 +209,45 @@ async def time_chosen(message: types.Message, state: FSMContext):
         if msg['places'] < 4:
             follow_button_data = request_cb.new(action=Action.FOLLOW_START.value, **args)
             reserve_button_data = request_cb.new(action=Action.RESERVE_START.value, **args)
+            auto_button_data = request_cb.new(action=Action.AUTO_START.value, **args)
             keyboard.row(types.InlineKeyboardButton('Отслеживать', callback_data=follow_button_data),
                          types.InlineKeyboardButton('Резерв', callback_data=reserve_button_data))
+            keyboard.row(types.InlineKeyboardButton('Автобронирование', callback_data=auto_button_data))
 
         if msg['places'] > 0:
             booking_button_data = request_cb.new(action=Action.BOOKING_START.value, **args)
             keyboard.row(types.InlineKeyboardButton('Забронировать', callback_data=booking_button_data))
 
-        await message.answer(msg['message'], reply_markup=keyboard)
+        await message.answer(msg['message'] + age_note, reply_markup=keyboard)
+
+
+async def window_chosen(message: types.Message, state: FSMContext, time: str, time_to: str):
+    user_data = await state.get_data()
+    snapshot = await availability.search(user_data['date'], user_data['departure'], user_data['destination'])
+
+    if snapshot is None:
+        await message.answer('<b>Ошибка.</b> Не удалось загрузить список рейсов.')
+        return
+
+    trips = [t for t in snapshot.trips if time <= t['time'] <= time_to]
+    age_note = parse_snapshot_age(snapshot.age) if availability.is_stale(snapshot) else ''
+
+    args = {
+        'departure': user_data['departure'],
+        'destination': user_data['destination'],
+        'date': user_data['date'],
+        'time': f'{time}-{time_to}',
+        'id': '-'
+    }
+
+    keyboard = types.InlineKeyboardMarkup()
+    keyboard.row(*[types.InlineKeyboardButton(str(i), callback_data=request_cb.new(
+        action=Action.FOLLOW_PLACES.value, places=str(i), **args)) for i in range(1, 5)])
+
+    await message.answer(f"<b>Рейсов с {time} до {time_to}:</b> {len(trips)}\n"
+                         f"<b>Свободных мест:</b> {sum(t['free_places'] for t in trips)}\n\n"
+                         f"Укажи необходимое количество мест, и когда они освободятся на любом рейсе из этого "
+                         f"промежутка, ты получишь уведомление.{age_note}", reply_markup=keyboard)
 
 
 async def station_chosen(message: types.Message, state: FSMContext):
@@ -187,31 +266,32 @@ async def station_chosen(message: types.Message, state: FSMContext):
         return
 
     user_data = await state.get_data()
-    stations = get_stations(user_data['departure'], user_data['destination'])
+    stations = await station_catalog.get(user_data['departure'], user_data['destination'])
 
     if stations is None:
         await message.answer('<b>Ошибка</b>. Не удалось обработать сообщение.\n\nВозвращаемся к поиску рейсов.')
         await start_trip_search(message, state)
         return
 
-    for s in stations:
-        if s['name'].lower() == message.text.lower():
+    station_id = stations.find(message.text)
 
-            booking_data = create_booking(token, user_data['departure'], user_data['destination'], user_data['date'],
-                                          user_data['time'], user_data['places'], user_data['trip_id'], s['id'])
+    if station_id is None:
+        return
 
-            if booking_data is None:
-                await message.answer('<b>Ошибка</b>. Не удалось создать бронирование.')
+    booking_data = await create_booking(token, user_data['departure'], user_data['destination'], user_data['date'],
+                                        user_data['time'], user_data['places'], user_data['trip_id'], station_id)
 
-            elif booking_data['status'] == 'false':
-                await message.answer(f'<b>Ошибка</b>. {booking_data["error"]}')
+    if booking_data is None:
+        await message.answer('<b>Ошибка</b>. Не удалось создать бронирование.')
 
-            else:
-                await message.answer('Бронирование успешно создано.\n<em>Надень в автобусе маску, пожалуйста.</em>\n\n'
-                                     'Возвращаемся к поиску рейсов.')
+    elif booking_data['status'] == 'false':
+        await message.answer(f'<b>Ошибка</b>. {booking_data["error"]}')
 
-            await start_trip_search(message, state)
-            return
+    else:
+        await message.answer('Бронирование успешно создано.\n<em>Надень в автобусе маску, пожалуйста.</em>\n\n'
+                             'Возвращаемся к поиску рейсов.')
+
+    await start_trip_search(message, state)
 
 
 async def callback_start(query: types.CallbackQuery, callback_data: dict):
@@ -234,6 +314,8 @@ async def callback_start(query: types.CallbackQuery, callback_data: dict):
             args.update({'action': Action.FOLLOW_PLACES.value})
         elif args['action'] == Action.RESERVE_START.value:
             args.update({'action': Action.RESERVE_PLACES.value})
+        elif args['action'] == Action.AUTO_START.value:
+            args.update({'action': Action.AUTO_PLACES.value})
 
         for i in range(int(callback_data['places']) + 1, 5):
             buttons.append(types.InlineKeyboardButton(str(i), callback_data=request_cb.new(places=str(i), **args)))
@@ -247,15 +329,28 @@ async def callback_start(query: types.CallbackQuery, callback_data: dict):
     await query.answer('Укажи необходимое количество мест.')
 
 
+async def restore_trip_keyboard(query: types.CallbackQuery, callback_data: dict):
+    # window follows are created from a bare places keyboard, there are no trip buttons to bring back
+    if '-' in callback_data['time']:
+        await query.message.edit_reply_markup(reply_markup=None)
+        return
+
+    try:
+        callback_data['places'] = int(query.message.reply_markup.inline_keyboard[0][0]['text']) - 1  # not sure
+        await callback_cancel(query, callback_data)
+    except ValueError:
+        await query.message.edit_reply_markup(reply_markup=None)
+
+
 async def callback_follow_places(query: types.CallbackQuery, callback_data: dict):
-    trip_time = datetime.datetime.strptime(f"{callback_data['date']} {callback_data['time']}", "%Y-%m-%d %H:%M")
+    time, time_to = split_time_window(callback_data['time'])
 
-    if trip_time < datetime.datetime.now():
+    if departure_timestamp(callback_data['date'], time_to) < current_timestamp():
         await query.answer('Нельзя отслеживать уехавшие маршрутки...', show_alert=True)
         await query.message.edit_reply_markup(None)
         return
 
-    user_trips = get_user_trips(query.message.chat.id)
+    user_trips = await get_user_trips(query.message.chat.id)
 
     if len([t for t in user_trips if t.status == 1]) > 6:
         await query.answer('Ты можешь отслеживать не более семи рейсов.', show_alert=True)
@@ -265,63 +360,129 @@ async def callback_follow_places(query: types.CallbackQuery, callback_data: dict
         if t.departure.lower() == callback_data['departure'].lower() \
                 and t.destination.lower() == callback_data['destination'].lower() \
                 and t.date == callback_data['date'] \
-                and t.time == callback_data['time']:
+                and t.time == time and t.time_to == time_to:
 
             if t.places == int(callback_data['places']):
                 updated_places = None
 
                 if t.status == 1:
                     await query.answer('Ты уже отслеживаешь этот рейс.', show_alert=True)
-
-                    try:
-                        callback_data['places'] = int(query.message.reply_markup.inline_keyboard[0][0]['text']) - 1
-                        await callback_cancel(query, callback_data)
-                    except ValueError:
-                        await query.message.edit_reply_markup(reply_markup=None)
-
+                    await restore_trip_keyboard(query, callback_data)
                     return
 
             else:
                 updated_places = callback_data['places']
 
-            update_trip(t.id, True, updated_places)
+            await update_trip(t.id, True, updated_places)
             await query.answer('Отслеживание рейса возобновлено.', show_alert=True)
-
-            try:
-                callback_data['places'] = int(query.message.reply_markup.inline_keyboard[0][0]['text']) - 1
-                await callback_cancel(query, callback_data)
-            except ValueError:
-                await query.message.edit_reply_markup(reply_markup=None)
-
+            await restore_trip_keyboard(query, callback_data)
             return
 
-    create_trip(
+    await create_trip(
         query.message.chat.id,
         callback_data['departure'],
         callback_data['destination'],
         callback_data['date'],
-        callback_data['time'],
-        callback_data['places']
+        time,
+        callback_data['places'],
+        time_to=time_to
     )
 
     await query.answer('Рейс добавлен в отслеживаемые.', show_alert=True)
+    await restore_trip_keyboard(query, callback_data)
 
-    try:
-        callback_data['places'] = int(query.message.reply_markup.inline_keyboard[0][0]['text']) - 1  # not sure
-        await callback_cancel(query, callback_data)
-    except ValueError:
-        await query.message.edit_reply_markup(reply_markup=None)
+
+async def callback_auto_places(query: types.CallbackQuery, callback_data: dict, state: FSMContext):
+    if departure_timestamp(callback_data['date'], callback_data['time']) < current_timestamp():
+        await query.answer('Нельзя отслеживать уехавшие маршрутки...', show_alert=True)
+        await query.message.edit_reply_markup(None)
+        return
+
+    token = await get_token(state)
+
+    if token is None:
+        await query.answer('Автобронирование доступно только авторизованным пользователям. '
+                           'Пройди авторизацию в личном кабинете (/account).', show_alert=True)
+        return
+
+    stations, user_info = await asyncio.gather(
+        station_catalog.get(callback_data['departure'], callback_data['destination']),
+        get_user(token)
+    )
+
+    if stations is None or user_info is None:
+        await query.answer('Ошибка. Не удалось загрузить данные для бронирования.', show_alert=True)
+        return
+
+    if user_info['fio'] is None:
+        await query.answer('Для бронирования рейсов необходимо указать фамилию в личном кабинете (/account).',
+                           show_alert=True)
+        return
+
+    # the matcher books with the stored token and last name, so a freed seat costs a single request
+    await state.update_data(fio=user_info['fio'])
+
+    user_trips = await get_user_trips(query.message.chat.id)
+    trip = next((t for t in user_trips if t.departure == callback_data['departure']
+                 and t.destination == callback_data['destination']
+                 and t.date == callback_data['date'] and t.time == t.time_to == callback_data['time']), None)
+
+    if (trip is None or trip.status != 1) and len([t for t in user_trips if t.status == 1]) > 6:
+        await query.answer('Ты можешь отслеживать не более семи рейсов.', show_alert=True)
+        return
+
+    if trip is None:
+        trip = await create_trip(query.message.chat.id, callback_data['departure'], callback_data['destination'],
+                                 callback_data['date'], callback_data['time'], callback_data['places'])
+
+        if trip is None:
+            await query.answer('Ошибка. Не удалось создать отслеживание.', show_alert=True)
+            return
+
+    else:
+        await update_trip(trip.id, True, callback_data['places'])
+
+    keyboard = types.InlineKeyboardMarkup(row_width=1)
+    keyboard.add(*[types.InlineKeyboardButton(name, callback_data=auto_cb.new(id=trip.id, station=stations.find(name)))
+                   for name in stations.names])
+
+    await query.answer()
+    await query.message.reply('Выбери место посадки. Как только на рейс освободятся места, бот сам забронирует их '
+                              'и пришлёт уведомление.', reply_markup=keyboard)
+    await restore_trip_keyboard(query, callback_data)
+
+
+async def callback_auto_station(query: types.CallbackQuery, callback_data: dict):
+    if not await set_trip_station(int(callback_data['id']), query.message.chat.id, int(callback_data['station'])):
+        await query.answer('Отслеживание рейса не найдено.', show_alert=True)
+        await query.message.edit_reply_markup(None)
+        return
+
+    await query.answer()
+    await query.message.edit_text('<b>Автобронирование включено.</b> Когда на рейс освободятся места, '
+                                  'ты получишь уведомление о бронировании.', reply_markup=None)
 
 
 async def callback_booking_places(query: types.CallbackQuery, callback_data: dict, state: FSMContext):
-    stations = get_stations(callback_data['departure'], callback_data['destination'])
+    # seats shown in the search may be stale, so the trip is re-checked against fresh data before booking
+    stations, snapshot = await asyncio.gather(
+        station_catalog.get(callback_data['departure'], callback_data['destination']),
+        availability.refresh(callback_data['date'], callback_data['departure'], callback_data['destination'])
+    )
 
     if stations is None:
         await query.answer('Ошибка. Не удалось загрузить список остановочных пунктов.', show_alert=True)
         return
 
+    if snapshot is not None:
+        trip = next((t for t in snapshot.trips if str(t['id']) == callback_data['id']), None)
+
+        if trip is None or trip['free_places'] < int(callback_data['places']):
+            await query.answer('Свободных мест на этот рейс уже нет.', show_alert=True)
+            return
+
     keyboard = types.ReplyKeyboardMarkup(resize_keyboard=True, input_field_placeholder='Место посадки', row_width=1)
-    keyboard.add(*[s['name'] for s in stations], 'Отменить')
+    keyboard.add(*stations.names, 'Отменить')
 
     await state.update_data({'departure': callback_data['departure'],
                              'destination': callback_data['destination'],
@@ -346,7 +507,7 @@ async def callback_reserve_places(query: types.CallbackQuery, callback_data: dic
         await callback_cancel(query, callback_data)
         return
 
-    reserve_data = create_reserve(token, callback_data['id'], callback_data['places'])
+    reserve_data = await create_reserve(token, callback_data['id'], callback_data['places'])
 
     if reserve_data is None:
         await query.answer('Возникла ошибка при отправке запроса.', show_alert=True)
@@ -376,8 +537,10 @@ async def callback_cancel(query: types.CallbackQuery, callback_data: dict):
     if int(callback_data['places']) < 4:
         follow_button_data = request_cb.new(action=Action.FOLLOW_START.value, **callback_data)
         reserve_button_data = request_cb.new(action=Action.RESERVE_START.value, **callback_data)
+        auto_button_data = request_cb.new(action=Action.AUTO_START.value, **callback_data)
         keyboard.row(types.InlineKeyboardButton('Отслеживать', callback_data=follow_button_data),
                      types.InlineKeyboardButton('Резерв', callback_data=reserve_button_data))
+        keyboard.row(types.InlineKeyboardButton('Автобронирование', callback_data=auto_button_data))
 
     if int(callback_data['places']) > 0:
         booking_button_data = request_cb.new(action=Action.BOOKING_START.value, **callback_data)
@@ -390,7 +553,7 @@ async def callback_cancel(query: types.CallbackQuery, callback_data: dict):
 
 
 async def callback_follow_date(query: types.CallbackQuery, callback_data: dict):
-    dates = get_user_dates(query.message.chat.id)
+    dates = await get_user_dates(query.message.chat.id)
 
     if len(dates) > 2:
         await query.answer('Ты можешь отслеживать не более трёх дат.', show_alert=True)
@@ -404,8 +567,11 @@ async def callback_follow_date(query: types.CallbackQuery, callback_data: dict):
             await query.answer('Ты уже отслеживаешь эту дату.', show_alert=True)
             return
 
-    create_user_date(query.message.chat.id, callback_data['date'],
-                     callback_data['departure'], callback_data['destination'])
+    if await create_user_date(query.message.chat.id, callback_data['date'],
+                              callback_data['departure'], callback_data['destination']) is None:
+        await query.message.edit_reply_markup(None)
+        await query.answer('Ты уже отслеживаешь эту дату.', show_alert=True)
+        return
 
     await query.answer()
     await query.message.edit_text('<b>Отслеживание создано.</b> Когда на эту дату откроется бронирование, '
@@ -426,7 +592,8 @@ def register_handlers_trip_search(dp: Dispatcher):
 
     dp.register_callback_query_handler(callback_cancel, request_cb.filter(action=Action.CANCEL.value), state="*")
 
-    for action in [Action.FOLLOW_START.value, Action.RESERVE_START.value, Action.BOOKING_START.value]:
+    for action in [Action.FOLLOW_START.value, Action.RESERVE_START.value, Action.BOOKING_START.value,
+                   Action.AUTO_START.value]:
         dp.register_callback_query_handler(callback_start,
                                            request_cb.filter(action=action), state='*')
 
@@ -438,3 +605,6 @@ def register_handlers_trip_search(dp: Dispatcher):
                                        state="*")
     dp.register_callback_query_handler(callback_follow_date, request_cb.filter(action=Action.FOLLOW_DATE.value),
                                        state="*")
+    dp.register_callback_query_handler(callback_auto_places, request_cb.filter(action=Action.AUTO_PLACES.value),
+                                       state="*")
+    dp.register_callback_query_handler(callback_auto_station, auto_cb.filter(), state="*")
@@ -4,8 +4,8 @@ import logging
 from typing import Union, Dict, List
 from aiogram import types
 
-from ..utils.actions import Action
-from ..utils.date_strings import generate_readable_date
+from ..utils.actions import Action, request_cb
+from ..utils.date_strings import generate_readable_date, generate_date_string
 
 logger = logging.getLogger(__name__)
 
@@ -64,12 +64,23 @@ def parse_trips_info(trips: List[Dict], direction: str) -> List[Dict]:
     return result
 
 
+def parse_follow_time(time: str, time_to: str) -> str:
+    if not time_to or time_to == time:
+        return time
+
+    return f"с {time} до {time_to}"
+
+
 def parse_favourite(trip):
     message = f"<b>Маршрут:</b> {trip.departure} – {trip.destination}\n\n" \
               f"<b>Дата:</b> {datetime.datetime.strptime(trip.date, '%Y-%m-%d').strftime('%d/%m/%Y')}\n" \
-              f"<b>Время:</b> {trip.time}\n<b>Количество мест:</b> {trip.places}\n\n" \
+              f"<b>Время:</b> {parse_follow_time(trip.time, trip.time_to)}\n" \
+              f"<b>Количество мест:</b> {trip.places}\n\n" \
               f"<b>Добавлен:</b> {trip.created_at.strftime('%d/%m/%Y %H:%M')}"
 
+    if trip.station_id is not None:
+        message += "\n<em>Автобронирование включено.</em>"
+
     return message
 
 
@@ -107,7 +118,50 @@ def parse_archive(trip):
     return message
 
 
-def parse_notification(departure: str, destination: str, date: str, time: str, places: int, trip_id: int):
+def parse_snapshot_age(age: float) -> str:
+    if age < 60:
+        return f"\n\n<em>Данные о местах получены {int(age)} с назад и сейчас обновляются.</em>"
+
+    return f"\n\n<em>Данные о местах получены {int(age // 60)} мин назад и сейчас обновляются.</em>"
+
+
+def parse_range_summary(direction: str, days: List, window=None) -> str:
+    message = f"<b>Маршрут:</b> {direction}\n"
+
+    if window is not None:
+        message += f"<b>Время:</b> с {window[0]} до {window[1]}\n"
+
+    message += "\n"
+
+    for date, trips in days:
+        message += f"<b>{generate_date_string(date)}:</b> "
+
+        if trips is None:
+            message += "не удалось загрузить\n"
+            continue
+
+        if window is not None:
+            trips = [t for t in trips if window[0] <= t['time'] <= window[1]]
+
+        merged_trips = {}
+
+        for t in trips:
+            merged_trips[t['time']] = merged_trips.get(t['time'], 0) + t['free_places']
+
+        free = [f"{key} ({value})" for key, value in sorted(merged_trips.items()) if value > 0]
+
+        if not trips:
+            message += "рейсов нет\n"
+        elif not free:
+            message += "мест нет\n"
+        else:
+            message += ", ".join(free[:4]) + (" …" if len(free) > 4 else "") + "\n"
+
+    return message
+
+
+def parse_notification(departure: str, destination: str, date: str, time: str, places: int, trip_id: int,
+                       window: str = None):
     if places == 1:
         message = "<b>Доступно одно место</b> "
 
@@ -117,17 +171,30 @@ def parse_notification(departure: str, destination: str, date: str, time: str, p
     message += f"на рейс {departure} – {destination} в {generate_readable_date(date)}, в {time}."
 
     keyboard = types.InlineKeyboardMarkup(row_width=1)
-    keyboard.add(types.InlineKeyboardButton('Забронировать',
-                                            callback_data=f"do|{Action.BOOKING_PLACES.value}|{departure}|{destination}"
-                                                          f"|{date}|{time}|{str(trip_id)}|{str(places)}"),
-                 types.InlineKeyboardButton('Продолжить отслеживание',
-                                            callback_data=f"do|{Action.FOLLOW_PLACES.value}|{departure}|{destination}"
-                                                          f"|{date}|{time}|{str(trip_id)}|{str(places)}")
-                 )
+    args = {'departure': departure, 'destination': destination, 'date': date, 'places': str(places)}
+
+    # following again doesn't need the trip id, leaving it out keeps long windows within the 64 byte limit
+    for text, action, data in (('Забронировать', Action.BOOKING_PLACES, {'time': time, 'id': str(trip_id)}),
+                               ('Продолжить отслеживание', Action.FOLLOW_PLACES, {'time': window or time, 'id': '-'})):
+        try:
+            keyboard.add(types.InlineKeyboardButton(text, callback_data=request_cb.new(action=action.value, **args,
+                                                                                        **data)))
+        except ValueError:
+            logger.warning(f'Callback data for {departure} – {destination} is too long, {text} button is left out.')
 
     return message, keyboard
 
 
+def parse_auto_booking(departure: str, destination: str, date: str, time: str, places: int):
+    return f"<b>Места забронированы автоматически</b> на рейс {departure} – {destination} в " \
+           f"{generate_readable_date(date)}, в {time} (мест: {places}).\n\n" \
+           f"Бронирование можно посмотреть или отменить в личном кабинете (/account)."
+
+
+def parse_auto_booking_error(error: str, notification: str):
+    return f"<b>Не удалось забронировать места автоматически.</b> {error}\n\n{notification}"
+
+
 def parse_date_notification(date, departure, destination):
     return f"<b>Открыто бронирование</b> мест на маршрут {departure} – {destination} на " \
            f"{generate_readable_date(date)}."
@@ -1,5 +1,7 @@
 from enum import Enum
 
+from aiogram.utils.callback_data import CallbackData
+
 
 class Action(Enum):
     FOLLOW_START = '0'
@@ -10,3 +12,8 @@ class Action(Enum):
     BOOKING_PLACES = '5'
     CANCEL = '6'
     FOLLOW_DATE = '7'
+    AUTO_START = '8'
+    AUTO_PLACES = '9'
+
+
+request_cb = CallbackData('do', 'action', 'departure', 'destination', 'date', 'time', 'id', 'places', sep='|')
@@ -0,0 +1,42 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from ..utils import dbworker
+
+# all database work runs on one dedicated thread, so a slow poll-cycle write never blocks the event loop
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='dbworker')
+
+
+async def run_db(func, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+def _async(func):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        return await run_db(func, *args, **kwargs)
+
+    return wrapper
+
+
+async def shutdown():
+    await run_db(dbworker.close_database)
+    _executor.shutdown(wait=True)
+
+
+connect_database = _async(dbworker.connect_database)
+create_trip = _async(dbworker.create_trip)
+get_user_trips = _async(dbworker.get_user_trips)
+update_trip = _async(dbworker.update_trip)
+set_trip_station = _async(dbworker.set_trip_station)
+get_user_dates = _async(dbworker.get_user_dates)
+create_user_date = _async(dbworker.create_user_date)
+get_date_follows = _async(dbworker.get_date_follows)
+commit_poll_results = _async(dbworker.commit_poll_results)
+clear_trips = _async(dbworker.clear_trips)
+load_follow_index = _async(dbworker.load_follow_index)
+get_popular_routes = _async(dbworker.get_popular_routes)
+get_stats = _async(dbworker.get_stats)
+delete_record = _async(dbworker.delete_record)
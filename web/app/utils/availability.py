@@ -0,0 +1,129 @@
+import asyncio
+import logging
+import time
+
+from ..utils.data_requests import get_trips
+
+logger = logging.getLogger(__name__)
+
+
+class Snapshot:
+    __slots__ = ('trips', 'by_time', 'fetched_at')
+
+    def __init__(self, trips, fetched_at: float):
+        self.trips = trips
+        self.by_time = {}
+        self.fetched_at = fetched_at
+
+        for t in trips:
+            self.by_time.setdefault(t['time'], []).append(t)
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched_at
+
+
+class AvailabilityCache:
+    def __init__(self, search_ttl: float = 20, stale_limit: float = 600):
+        self.search_ttl = search_ttl
+        self.stale_limit = stale_limit
+        self._snapshots = {}
+        self._refreshing = set()
+        self._subscribers = []
+        self.demand = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get_snapshot(self, date: str, city_1: str, city_2: str, max_age: float, skip=None):
+        snapshot = self._snapshots.get((date, city_1, city_2))
+
+        if snapshot is not None and snapshot.age <= max_age:
+            return snapshot
+
+        trips = await get_trips(date, city_1, city_2)
+
+        if trips is None:
+            return None
+
+        snapshot = self._snapshots[(date, city_1, city_2)] = Snapshot(trips, time.monotonic())
+        self._publish((date, city_1, city_2), trips, skip)
+        return snapshot
+
+    def subscribe(self, callback):
+        # callback(route, trips) is called synchronously for every upstream response and must not block,
+        # a poller passes its own callback as skip for the responses it handles itself
+        self._subscribers.append(callback)
+
+    def _publish(self, route, trips, skip=None):
+        for callback in self._subscribers:
+            if callback == skip:
+                continue
+
+            try:
+                callback(route, trips)
+            except Exception:
+                logger.exception(f'Unable to publish trips of {route}.')
+
+    async def get_trips(self, date: str, city_1: str, city_2: str, max_age: float, skip=None):
+        snapshot = await self.get_snapshot(date, city_1, city_2, max_age, skip)
+        return None if snapshot is None else snapshot.trips
+
+    async def refresh(self, date: str, city_1: str, city_2: str):
+        return await self.get_snapshot(date, city_1, city_2, 0)
+
+    def _refresh_in_background(self, key):
+        if key in self._refreshing:
+            return
+
+        self._refreshing.add(key)
+        task = asyncio.create_task(self.refresh(*key))
+        task.add_done_callback(lambda _: self._refreshing.discard(key))
+
+    async def search(self, date: str, city_1: str, city_2: str):
+        # stale-while-revalidate: a not too old snapshot is served at once and refreshed in the background
+        self.demand[(city_1, city_2)] = self.demand.get((city_1, city_2), 0) + 1
+        snapshot = self._snapshots.get((date, city_1, city_2))
+
+        if snapshot is not None and snapshot.age <= self.stale_limit:
+            if snapshot.age > self.search_ttl:
+                self._refresh_in_background((date, city_1, city_2))
+
+            self.hits += 1
+            return snapshot
+
+        self.misses += 1
+        return await self.refresh(date, city_1, city_2)
+
+    def peek(self, date: str, city_1: str, city_2: str):
+        # never waits for upstream, a missing or stale snapshot is refreshed in the background
+        snapshot = self._snapshots.get((date, city_1, city_2))
+
+        if snapshot is None or snapshot.age > self.search_ttl:
+            self._refresh_in_background((date, city_1, city_2))
+
+        if snapshot is None or snapshot.age > self.stale_limit:
+            return None
+
+        return snapshot
+
+    def is_stale(self, snapshot: Snapshot):
+        return snapshot.age > self.search_ttl
+
+    def is_fresh(self, date: str, city_1: str, city_2: str, max_age: float = None):
+        snapshot = self._snapshots.get((date, city_1, city_2))
+        return snapshot is not None and snapshot.age <= (self.search_ttl if max_age is None else max_age)
+
+    def decay_demand(self):
+        self.demand = {k: v / 2 for k, v in self.demand.items() if v >= 1}
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def prune(self):
+        for key in [k for k, s in self._snapshots.items() if s.age > self.stale_limit]:
+            del self._snapshots[key]
+
+
+availability = AvailabilityCache()
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import time
+
+from ..utils.data_requests import get_direction_pairs, get_direction_name, get_stations
+
+logger = logging.getLogger(__name__)
+
+
+class RouteCatalog:
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+        self.names = []
+        self._lookup = {}
+        self._queries = {}  # 'departure destination' casefolded -> (departure, destination)
+        self._updated_at = None
+        self._refresh_task = None
+
+    def __contains__(self, name: str):
+        return name in self._lookup
+
+    def lookup(self, name: str):
+        return self._lookup.get(name)
+
+    def find(self, query: str):
+        # the longest leading run of words naming a route, the rest of the query is returned as is
+        words = [w for w in query.split() if w not in ('-', '–', '—')]
+
+        for i in range(len(words), 1, -1):
+            route = self._queries.get(' '.join(words[:i]).casefold())
+
+            if route is not None:
+                return route, ' '.join(words[i:])
+
+        return None
+
+    @property
+    def expired(self):
+        return self._updated_at is None or time.monotonic() - self._updated_at > self.ttl
+
+    async def refresh(self):
+        directions = await get_direction_pairs()
+
+        if directions is None:
+            return False
+
+        lookup = {get_direction_name(departure, destination): (departure, destination)
+                  for departure, destination in directions}
+
+        queries = {f"{departure} {destination}".casefold(): (departure, destination)
+                   for departure, destination in directions}
+
+        self.names, self._lookup, self._queries = list(lookup), lookup, queries
+        self._updated_at = time.monotonic()
+        return True
+
+    def _refresh_in_background(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+
+    async def get_directions(self):
+        if not self.names:
+            await self.refresh()
+            return self.names or None
+
+        if self.expired:
+            self._refresh_in_background()
+
+        return self.names
+
+
+class RouteStations:
+    __slots__ = ('names', 'ids', 'fetched_at')
+
+    def __init__(self, stations):
+        self.names = [s['name'] for s in stations]
+        self.ids = {s['name'].casefold(): s['id'] for s in stations}
+        self.fetched_at = time.monotonic()
+
+    def find(self, name: str):
+        return self.ids.get(name.casefold())
+
+
+class StationCatalog:
+    def __init__(self, ttl: float = 3600):
+        self.ttl = ttl
+        self._routes = {}
+
+    async def get(self, departure: str, destination: str):
+        entry = self._routes.get((departure, destination))
+
+        if entry is not None and time.monotonic() - entry.fetched_at <= self.ttl:
+            return entry
+
+        stations = await get_stations(departure, destination)
+
+        if stations is None:
+            return entry  # an outdated list is still better than none
+
+        entry = self._routes[(departure, destination)] = RouteStations(stations)
+        return entry
+
+
+routes = RouteCatalog()
+station_catalog = StationCatalog()
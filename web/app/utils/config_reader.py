@@ -8,9 +8,63 @@ class TelegramBot:
     admin_id: int
 
 
+@dataclass
+class Poller:
+    concurrency: int
+    snapshot_ttl: float
+    tick: int
+    min_interval: float
+    max_interval: float
+    budget: float
+    queue_size: int
+
+
+@dataclass
+class Dates:
+    horizon_days: float
+    lead_minutes: int
+    late_interval: int
+    max_delay: int
+
+
+@dataclass
+class Notifier:
+    rate: float
+    workers: int
+    retries: int
+
+
+@dataclass
+class Catalog:
+    routes_ttl: float
+    stations_ttl: float
+
+
+@dataclass
+class Search:
+    snapshot_ttl: float
+    stale_limit: float
+    inline_cache_time: int
+
+
+@dataclass
+class Warmer:
+    routes: int
+    days: int
+    interval: int
+    pace: float
+    max_age: float
+
+
 @dataclass
 class Config:
     telegram_bot: TelegramBot
+    poller: Poller
+    dates: Dates
+    notifier: Notifier
+    catalog: Catalog
+    search: Search
+    warmer: Warmer
 
 
 def load_config(path: str):
@@ -19,4 +73,28 @@ def load_config(path: str):
 
     telegram_bot = config["telegram_bot"]
 
-    return Config(telegram_bot=TelegramBot(token=telegram_bot["token"], admin_id=int(telegram_bot["admin_id"])))
+    return Config(telegram_bot=TelegramBot(token=telegram_bot["token"], admin_id=int(telegram_bot["admin_id"])),
+                  poller=Poller(concurrency=config.getint("poller", "concurrency", fallback=8),
+                                snapshot_ttl=config.getfloat("poller", "snapshot_ttl", fallback=120),
+                                tick=config.getint("poller", "tick", fallback=5),
+                                min_interval=config.getfloat("poller", "min_interval", fallback=15),
+                                max_interval=config.getfloat("poller", "max_interval", fallback=1800),
+                                budget=config.getfloat("poller", "budget", fallback=60),
+                                queue_size=config.getint("poller", "queue_size", fallback=100)),
+                  dates=Dates(horizon_days=config.getfloat("dates", "horizon_days", fallback=10),
+                              lead_minutes=config.getint("dates", "lead_minutes", fallback=60),
+                              late_interval=config.getint("dates", "late_interval", fallback=10),
+                              max_delay=config.getint("dates", "max_delay", fallback=30)),
+                  notifier=Notifier(rate=config.getfloat("notifier", "rate", fallback=25),
+                                    workers=config.getint("notifier", "workers", fallback=8),
+                                    retries=config.getint("notifier", "retries", fallback=3)),
+                  catalog=Catalog(routes_ttl=config.getfloat("catalog", "routes_ttl", fallback=3600),
+                                  stations_ttl=config.getfloat("catalog", "stations_ttl", fallback=3600)),
+                  search=Search(snapshot_ttl=config.getfloat("search", "snapshot_ttl", fallback=20),
+                                stale_limit=config.getfloat("search", "stale_limit", fallback=600),
+                                inline_cache_time=config.getint("search", "inline_cache_time", fallback=5)),
+                  warmer=Warmer(routes=config.getint("warmer", "routes", fallback=10),
+                                days=config.getint("warmer", "days", fallback=4),
+                                interval=config.getint("warmer", "interval", fallback=60),
+                                pace=config.getfloat("warmer", "pace", fallback=0.5),
+                                max_age=config.getfloat("warmer", "max_age", fallback=180)))
@@ -1,74 +1,133 @@
+import asyncio
 import logging
-import requests
+from typing import Optional
+
+import aiohttp
 
 logger = logging.getLogger(__name__)
 base_url = 'https://prosta.by'
 
+timeouts = {
+    'cities': aiohttp.ClientTimeout(total=10, connect=3),
+    'trips': aiohttp.ClientTimeout(total=10, connect=3),
+    'confirm': aiohttp.ClientTimeout(total=15, connect=3),
+    'user': aiohttp.ClientTimeout(total=10, connect=3),
+    'tickets': aiohttp.ClientTimeout(total=15, connect=3),
+    'booking': aiohttp.ClientTimeout(total=20, connect=3),
+}
+
+_session: Optional[aiohttp.ClientSession] = None
+_trips_requests = {}
+
+
+def get_session() -> aiohttp.ClientSession:
+    global _session
+
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=100, limit_per_host=50, keepalive_timeout=60, ttl_dns_cache=300)
+        _session = aiohttp.ClientSession(connector=connector)
+
+    return _session
+
+
+async def close_session():
+    global _session
+
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+    _session = None
+
+
+async def _request(method: str, path: str, endpoint: str, **kwargs):
+    try:
+        async with get_session().request(method, base_url + path, timeout=timeouts[endpoint], **kwargs) as response:
+            if response.status != 200:
+                return None
+
+            return await response.json(content_type=None)
+
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        logger.warning(f'Request to {path} failed: {e!r}')
+        return None
+
 
 def get_direction_name(city_1, city_2):
     return f"{city_1} – {city_2}"
 
 
-def get_directions():
-    response = requests.get(base_url + '/cities.get')
+async def get_direction_pairs():
+    cities_data = await _request('GET', '/cities.get', 'cities')
 
-    if response.status_code != 200:
+    if cities_data is None:
         logger.error('Unable to get cities data.')
         return None
 
-    cities_data = response.json()
-
     if cities_data['status'] != 'ok':
         logger.error('Error while getting cities info.')
         return None
 
-    directions = []
+    directions = [(c['name'], p) for c in cities_data['cities'] for p in c['cities']]
+    available = set(directions)
+    sorted_directions = {}
 
-    for c in cities_data['cities']:
-        [directions.append(x) for x in list(map(lambda p: [c['name'], p], c['cities']))]
+    # each direction is followed by its reverse one, dict keeps the insertion order
+    for d in directions:
+        sorted_directions.setdefault(d, None)
 
-    sorted_directions = []
+        if (d[1], d[0]) in available:
+            sorted_directions.setdefault((d[1], d[0]), None)
+
+    return list(sorted_directions)
 
-    for d in directions:
-        tmp = [d[1], d[0]]
 
-        if d not in sorted_directions:
-            sorted_directions.append(d)
+async def get_directions():
+    directions = await get_direction_pairs()
 
-        if (tmp in directions) and (tmp not in sorted_directions):
-            sorted_directions.append(tmp)
+    if directions is None:
+        return None
 
-    return list(map(lambda p: get_direction_name(p[0], p[1]), sorted_directions))
+    return [get_direction_name(departure, destination) for departure, destination in directions]
 
 
-def get_trips(date: str, city_1: str, city_2: str, time=None):
-    response = requests.get(base_url + '/trips.get', params={'date': date, 'city_1': city_1, 'city_2': city_2})
+async def _fetch_trips(date: str, city_1: str, city_2: str):
+    trips_data = await _request('GET', '/trips.get', 'trips', params={'date': date, 'city_1': city_1, 'city_2': city_2})
 
-    if response.status_code != 200:
+    if trips_data is None:
         logger.error('Unable to get cities data.')
         return None
 
-    trips_data = response.json()
-
     if trips_data['status'] != 'ok':
         logger.error('Error while getting cities info.')
         return None
 
-    if time is None:
-        return trips_data['trips']
+    return trips_data['trips']
+
+
+async def get_trips(date: str, city_1: str, city_2: str, time=None):
+    # concurrent callers for the same route-date share one upstream request and its (read-only) result
+    key = (date, city_1, city_2)
+    request = _trips_requests.get(key)
+
+    if request is None:
+        request = _trips_requests[key] = asyncio.ensure_future(_fetch_trips(date, city_1, city_2))
+        request.add_done_callback(lambda _: _trips_requests.pop(key, None))
+
+    trips = await asyncio.shield(request)
+
+    if trips is None or time is None:
+        return trips
 
-    return list(filter(lambda x: x['time'] == time, trips_data['trips']))
+    return [t for t in trips if t['time'] == time]
 
 
-def send_code(phone):
-    response = requests.post(base_url + '/api/confirm.send', json={'phone': phone})
+async def send_code(phone):
+    confirm_data = await _request('POST', '/api/confirm.send', 'confirm', json={'phone': phone})
 
-    if response.status_code != 200:
+    if confirm_data is None:
         logger.error('Unable to send SMS.')
         return None
 
-    confirm_data = response.json()
-
     if confirm_data['status'] != 'ok':
         logger.error('Error while sending SMS.')
         return None
@@ -76,40 +135,45 @@ def send_code(phone):
     return confirm_data['confirm_id']
 
 
-def check_code(confirm_id, code):
-    response = requests.post(base_url + '/api/confirm.check', json={'confirm_id': confirm_id, 'code': code})
+async def check_code(confirm_id, code):
+    confirm_data = await _request('POST', '/api/confirm.check', 'confirm',
+                                  json={'confirm_id': confirm_id, 'code': code})
 
-    if response.status_code != 200:
+    if confirm_data is None:
         logger.error('Unable to check code.')
         return None
 
-    return response.json()
+    return confirm_data
 
 
-def create_booking(token, departure, destination, date, time, places, trip_id, station):
-    user_info = get_user(token)
+async def create_booking(token, departure, destination, date, time, places, trip_id, station, fio=None):
+    # a known last name saves the user.check round trip, auto-booking passes the one resolved in advance
+    if fio is None:
+        user_info = await get_user(token)
 
-    if user_info is None:
-        return None
+        if user_info is None:
+            return None
 
-    if user_info['fio'] is None:
+        fio = user_info['fio']
+
+    if fio is None:
         return {'status': 'false', 'error': 'Для бронирования рейсов необходимо указать фамилию в личном кабинете. '
                                             '(/account).'}
 
-    response = requests.post(base_url + '/api/ticket.create',
-                             json={'personal_token': token, 'city_1': departure, 'city_2': destination, 'date': date,
-                                   'time': time, 'places': places, 'trip_id': trip_id, 'station_id': station,
-                                   'fio': user_info['fio']})
+    booking_data = await _request('POST', '/api/ticket.create', 'booking',
+                                  json={'personal_token': token, 'city_1': departure, 'city_2': destination,
+                                        'date': date, 'time': time, 'places': places, 'trip_id': trip_id,
+                                        'station_id': station, 'fio': fio})
 
-    if response.status_code != 200:
+    if booking_data is None:
         logger.error('Unable to create booking.')
         return None
 
-    return response.json()
+    return booking_data
 
 
-def create_reserve(token, trip, places):
-    user_info = get_user(token)
+async def create_reserve(token, trip, places):
+    user_info = await get_user(token)
 
     if user_info is None:
         return None
@@ -118,25 +182,24 @@ def create_reserve(token, trip, places):
         return {'status': 'false', 'error': 'Для резервирования рейсов необходимо указать фамилию в личном кабинете. '
                                             '(/account).'}
 
-    response = requests.post(base_url + '/api/reserve.create',
-                             json={'personal_token': token, 'trip_id': trip, 'places': places, 'fio': user_info['fio']})
+    reserve_data = await _request('POST', '/api/reserve.create', 'booking',
+                                  json={'personal_token': token, 'trip_id': trip, 'places': places,
+                                        'fio': user_info['fio']})
 
-    if response.status_code != 200:
+    if reserve_data is None:
         logger.error('Unable to create reserve.')
         return None
 
-    return response.json()
+    return reserve_data
 
 
-def get_user(token):
-    response = requests.get(base_url + '/api/user.check', params={'personal_token': token})
+async def get_user(token):
+    user_data = await _request('GET', '/api/user.check', 'user', params={'personal_token': token})
 
-    if response.status_code != 200:
+    if user_data is None:
         logger.error('Unable to get user info.')
         return None
 
-    user_data = response.json()
-
     if user_data['status'] != 'ok':
         logger.error('Error while getting user info.')
         return None
@@ -144,15 +207,13 @@ def get_user(token):
     return user_data['user']
 
 
-def get_tickets(token, mode):
-    response = requests.get(base_url + '/api/tickets.get', params={'personal_token': token})
+async def get_tickets(token, mode):
+    tickets_data = await _request('GET', '/api/tickets.get', 'tickets', params={'personal_token': token})
 
-    if response.status_code != 200:
+    if tickets_data is None:
         logger.error('Unable to get users tickets.')
         return None
 
-    tickets_data = response.json()
-
     if tickets_data['status'] != 'ok':
         logger.error('Error while getting users tickets')
         return None
@@ -167,30 +228,28 @@ def get_tickets(token, mode):
         return [t for t in tickets_data['tickets'] if t['closed'] == 1]
 
 
-def cancel_trip(mode: str, ticket_id: int, token):
+async def cancel_trip(mode: str, ticket_id: int, token):
     if mode == 'booking':
-        url = base_url + '/api/ticket.cancel'
+        path = '/api/ticket.cancel'
     else:
-        url = base_url + '/api/reserve.cancel'
+        path = '/api/reserve.cancel'
 
-    response = requests.post(url, params={'personal_token': token, 'ticket_id': ticket_id})
+    cancel_data = await _request('POST', path, 'booking', params={'personal_token': token, 'ticket_id': ticket_id})
 
-    if response.status_code != 200:
+    if cancel_data is None:
         logger.error('Unable to cancel ticket.')
         return None
 
-    return response.json()
+    return cancel_data
 
 
-def get_stations(departure, destination):
-    response = requests.get(base_url + '/trips.get', params={'city_1': departure, 'city_2': destination})
+async def get_stations(departure, destination):
+    stations_data = await _request('GET', '/trips.get', 'trips', params={'city_1': departure, 'city_2': destination})
 
-    if response.status_code != 200:
+    if stations_data is None:
         logger.error('Unable to get stations list.')
         return None
 
-    stations_data = response.json()
-
     if stations_data['status'] != 'ok':
         logger.error('Error while getting stations list.')
         return None
@@ -198,11 +257,11 @@ def get_stations(departure, destination):
     return stations_data['stations_1']
 
 
-def update_last_name(last_name, token):
-    response = requests.post(base_url + '/api/user.update', params={'fio': last_name, 'personal_token': token})
+async def update_last_name(last_name, token):
+    update_data = await _request('POST', '/api/user.update', 'user', params={'fio': last_name, 'personal_token': token})
 
-    if response.status_code != 200:
+    if update_data is None:
         logger.error('Unable to update users last name.')
         return None
 
-    return response.json()
+    return update_data
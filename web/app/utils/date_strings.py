@@ -1,3 +1,4 @@
+import calendar
 import datetime
 import re
 
@@ -94,6 +95,55 @@ def parse_date_string(date_string: str):
     return None
 
 
+def parse_time_window(window_string: str):
+    match = re.match(r'^([0-1]?[0-9]|2[0-3]):([0-5][0-9]) ?[-–] ?([0-1]?[0-9]|2[0-3]):([0-5][0-9])$', window_string)
+
+    if match is None:
+        return None
+
+    time, time_to = f"{int(match[1]):02d}:{match[2]}", f"{int(match[3]):02d}:{match[4]}"
+    return (time, time_to) if time < time_to else None
+
+
+def parse_date_range(range_string: str):
+    # 'N дней' or 'ближайшие N дней', optionally followed by a departure window: '5 дней 07:00-09:30'
+    match = re.match(r'^(?:ближайшие )?(\d{1,2}) (?:день|дня|дней)(?: (.+))?$', range_string)
+
+    if match is None or not 0 < int(match[1]) <= 14:
+        return None
+
+    window = None
+
+    if match[2] is not None:
+        window = parse_time_window(match[2])
+
+        if window is None:
+            return None
+
+    today = datetime.datetime.today()
+    return [(today + datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(int(match[1]))], window
+
+
+def split_time_window(time: str):
+    # callback data keeps a departure window as 'ЧЧ:ММ-ЧЧ:ММ' and an exact time as is
+    time, _, time_to = time.partition('-')
+    return time, time_to or time
+
+
+def generate_date_string(date: str) -> str:
+    parsed_date = datetime.datetime.strptime(date, '%Y-%m-%d')
+    return f"{weekdays[parsed_date.weekday()]}, {parsed_date.day} {months[parsed_date.month - 1]}"
+
+
 def generate_readable_date(date: str) -> str:
     parsed_date = datetime.datetime.strptime(date, '%Y-%m-%d')
     return f"{adapted_weekdays[parsed_date.weekday()]}, {parsed_date.day} {months[parsed_date.month - 1]}"
+
+
+def departure_timestamp(date: str, time: str) -> int:
+    # local wall-clock time stored as if it were UTC, the same way SQLite's strftime('%s', ...) reads it
+    return calendar.timegm(datetime.datetime.strptime(f"{date} {time}", '%Y-%m-%d %H:%M').timetuple())
+
+
+def current_timestamp() -> int:
+    return calendar.timegm(datetime.datetime.now().timetuple())
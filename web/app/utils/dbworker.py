@@ -1,11 +1,20 @@
+import os
+
 from peewee import *
 
 from datetime import datetime
 
-from ..messages.formatter import parse_notification, parse_date_notification
-from ..utils.data_requests import get_trips
+from ..utils.follow_index import follow_index
+from ..utils.date_strings import departure_timestamp, current_timestamp
+
+os.makedirs('data', exist_ok=True)  # mounted as a whole by docker-compose, so -wal and -shm persist with bot.db
 
-database = SqliteDatabase('bot.db')
+database = SqliteDatabase('data/bot.db', timeout=10, pragmas={
+    'journal_mode': 'wal',  # poller writes don't block handler reads
+    'synchronous': 1,  # NORMAL is durable enough in WAL mode
+    'cache_size': -32 * 1024,  # 32 MB
+    'mmap_size': 256 * 1024 * 1024,
+})
 
 
 class BaseModel(Model):
@@ -19,49 +28,68 @@ class Trip(BaseModel):
     destination = CharField(max_length=16)
     date = DateField('%Y-%m-%d')
     time = TimeField('%H:%M')
+    time_to = TimeField('%H:%M')  # end of the departure window, equal to time for an exact follow
     places = IntegerField()
     status = IntegerField()
+    departs_at = IntegerField(index=True)
+    station_id = IntegerField(null=True)  # set when the follow books a seat by itself
     created_at = DateTimeField()
     updated_at = DateTimeField()
 
+    class Meta:
+        indexes = (
+            (('status', 'date', 'departure', 'destination', 'time'), False),
+            (('user_id', 'status', 'date', 'time'), False),
+            (('user_id', 'departure', 'destination', 'date', 'time', 'time_to', 'status'), True),
+        )
 
-def create_trip(user_id, departure, destination, date, time, places):
+
+def connect_database():
     database.connect(reuse_if_open=True)
 
-    with database.atomic():
-        trip = Trip.create(
-            user_id=user_id,
-            departure=departure,
-            destination=destination,
-            date=date,
-            time=time,
-            places=places,
-            status=1,
-            created_at=datetime.now(),
-            updated_at=datetime.now()
-        )
 
-    database.close()
+def close_database():
+    if not database.is_closed():
+        database.close()
+
+
+def create_trip(user_id, departure, destination, date, time, places, station_id=None, time_to=None):
+    time_to = time_to or time
+
+    try:
+        with database.atomic():
+            trip = Trip.create(
+                user_id=user_id,
+                departure=departure,
+                destination=destination,
+                date=date,
+                time=time,
+                time_to=time_to,
+                places=places,
+                status=1,
+                departs_at=departure_timestamp(date, time_to),
+                station_id=station_id,
+                created_at=datetime.now(),
+                updated_at=datetime.now()
+            )
+    except IntegrityError:  # the same follow was created by a concurrent update
+        return None
+
+    follow_index.add(trip.id, user_id, departure, destination, date, time, places, station_id, time_to)
     return trip
 
 
 def get_user_trips(user_id, active=False):
-    database.connect(reuse_if_open=True)
-
     with database.atomic():
         if not active:
-            trips = Trip.select().where((Trip.user_id == user_id) & (Trip.status < 2)).order_by(Trip.date, Trip.time)
+            trips = Trip.select().where((Trip.user_id == user_id) & (Trip.status < 2)).order_by(Trip.departs_at)
         else:
-            trips = Trip.select().where((Trip.user_id == user_id) & (Trip.status == 1)) \
-                .order_by(Trip.date, Trip.time)
+            trips = Trip.select().where((Trip.user_id == user_id) & (Trip.status == 1)).order_by(Trip.departs_at)
 
-    database.close()
-    return trips
+    return list(trips)
 
 
 def update_trip(trip, status, places=None):
-    database.connect(reuse_if_open=True)
-
     with database.atomic():
         if not places:
             query = Trip.update({Trip.status: status, Trip.updated_at: datetime.now()}).where(Trip.id == trip)
@@ -69,162 +97,116 @@ def update_trip(trip, status, places=None):
             query = Trip.update({Trip.status: status, Trip.places: places, Trip.updated_at: datetime.now()}) \
                 .where(Trip.id == trip)
         result = query.execute()
+        row = Trip.get_or_none(Trip.id == trip)
 
-    database.close()
-    return result
-
-
-def get_active_dates():
-    database.connect(reuse_if_open=True)
-
-    with database.atomic():
-        trips = Trip.select(Trip.date, Trip.departure, Trip.destination).distinct().where(Trip.status == 1)
-
-    database.close()
-    return trips
+    if row is not None and row.status == 1:
+        follow_index.add(row.id, row.user_id, row.departure, row.destination, row.date, row.time, row.places,
+                         row.station_id, row.time_to)
+    else:
+        follow_index.remove(trip)
 
+    return result
 
-def check_active_records(date: str, departure: str, destination: str, time: str, places: int):
-    database.connect(reuse_if_open=True)
 
+def set_trip_station(trip, user_id, station_id):
+    # callback data comes from the client, only the owner may attach a station to a follow
     with database.atomic():
-        trips = Trip.select(Trip.id, Trip.user_id, Trip.places).where(
-            (Trip.date == date) & (Trip.time == time) & (Trip.status == 1) & (Trip.departure == departure) &
-            (Trip.places <= places) & (Trip.destination == destination))
+        result = Trip.update({Trip.station_id: station_id, Trip.updated_at: datetime.now()}) \
+            .where((Trip.id == trip) & (Trip.user_id == str(user_id)) & (Trip.status == 1)).execute()
+        row = Trip.get_or_none(Trip.id == trip)
 
-    database.close()
+    if result:
+        follow_index.add(row.id, row.user_id, row.departure, row.destination, row.date, row.time, row.places,
+                         row.station_id, row.time_to)
 
-    return trips
+    return result
 
 
 def get_user_dates(user_id):
-    database.connect(reuse_if_open=True)
-
     with database.atomic():
         dates = Trip.select(Trip.id, Trip.date, Trip.departure, Trip.destination)\
             .where((Trip.user_id == user_id) & (Trip.status == 2)).order_by(Trip.date)
 
-    database.close()
-    return dates
+    return list(dates)
 
 
 def create_user_date(user_id, date, departure, destination):
-    database.connect(reuse_if_open=True)
-
-    with database.atomic():
-        date = Trip.create(
-            user_id=user_id,
-            departure=departure,
-            destination=destination,
-            date=date,
-            time='23:59',
-            places='1',
-            status=2,
-            created_at=datetime.now(),
-            updated_at=datetime.now()
-        )
+    try:
+        with database.atomic():
+            date = Trip.create(
+                user_id=user_id,
+                departure=departure,
+                destination=destination,
+                date=date,
+                time='23:59',
+                time_to='23:59',
+                places='1',
+                status=2,
+                departs_at=departure_timestamp(date, '23:59'),
+                created_at=datetime.now(),
+                updated_at=datetime.now()
+            )
+    except IntegrityError:  # a double tap on the follow button
+        return None
 
-    database.close()
     return date
 
 
-def check_dates():
-    messages = []
-
-    database.connect(reuse_if_open=True)
-
+def get_date_follows():
     with database.atomic():
-        dates = Trip.select(Trip.date, Trip.departure, Trip.destination).distinct().where(Trip.status == 2)
-
-    for item in dates:
-        trips = get_trips(item.date, item.departure, item.destination)
-
-        if trips is None:
-            continue
-
-        if len(trips) == 0:
-            continue
-
-        users = Trip.select(Trip.user_id).where((Trip.status == 2) & (Trip.date == item.date) &
-                                                (Trip.departure == item.departure) &
-                                                (Trip.destination == item.destination))
-
-        for user in users:
-            messages.append((user.user_id, parse_date_notification(item.date, item.departure, item.destination)))
-
-        query = Trip.delete().where((Trip.status == 2) & (Trip.date == item.date) & (Trip.departure == item.departure) &
-                                    (Trip.destination == item.destination))
-        query.execute()
-
-    return messages
+        dates = list(Trip.select(Trip.user_id, Trip.date, Trip.departure, Trip.destination).where(Trip.status == 2))
 
+    return dates
 
-def check_trips():
-    messages = []
 
-    database.connect(reuse_if_open=True)
+def commit_poll_results(closed_ids=(), fired_dates=()):
+    if not closed_ids and not fired_dates:
+        return
 
     with database.atomic():
-        dates = Trip.select(Trip.date, Trip.departure, Trip.destination).distinct().where(Trip.status == 1)
+        for batch in chunked(closed_ids, 500):
+            Trip.update({Trip.status: 0, Trip.updated_at: datetime.now()}).where(Trip.id << batch).execute()
 
-    for item in dates:
-        trips = get_trips(item.date, item.departure, item.destination)
+        for date, departure, destination in fired_dates:
+            Trip.delete().where((Trip.status == 2) & (Trip.date == date) & (Trip.departure == departure) &
+                                (Trip.destination == destination)).execute()
 
-        if trips is None:
-            continue
+    for trip_id in closed_ids:
+        follow_index.remove(trip_id)
 
-        for trip in trips:
-            concurrences = Trip.select(Trip.id, Trip.user_id, Trip.places).where(
-                (Trip.date == trip['date']) & (Trip.time == trip['time']) & (Trip.status == 1) & (
-                        Trip.departure == item.departure) &
-                (Trip.places <= trip['free_places']) & (Trip.destination == item.destination))
 
-            for c in concurrences:
-                messages.append((c.user_id, *parse_notification(item.departure, item.destination, trip['date'],
-                                                                trip['time'], c.places, trip['id'])))
-
-            query = Trip.update({Trip.status: 0, Trip.updated_at: datetime.now()}) \
-                .where(Trip.id << [c.id for c in concurrences])
-            query.execute()
-
-    database.close()
-
-    return messages
+def clear_trips():
+    with database.atomic():
+        Trip.delete().where(Trip.departs_at < current_timestamp()).execute()
 
+    load_follow_index()
 
-def clear_trips():
-    database.connect(reuse_if_open=True)
 
+def load_follow_index():
     with database.atomic():
-        times = Trip.select(Trip.date, Trip.time).distinct()
+        follow_index.rebuild(Trip.select().where(Trip.status == 1))
 
-        for t in times:
-            trip_time = datetime.strptime(f"{t.date} {t.time}", '%Y-%m-%d %H:%M')
 
-            if trip_time < datetime.now():
-                query = Trip.delete().where((Trip.date == t.date) & (Trip.time == t.time))
-                query.execute()
+def get_popular_routes(limit: int):
+    with database.atomic():
+        routes = Trip.select(Trip.departure, Trip.destination, fn.COUNT(Trip.id).alias('follows')) \
+            .where(Trip.status > 0).group_by(Trip.departure, Trip.destination) \
+            .order_by(fn.COUNT(Trip.id).desc()).limit(limit)
 
-    database.close()
+    return [(r.departure, r.destination, r.follows) for r in routes]
 
 
 def get_stats():
-    database.connect(reuse_if_open=True)
-
     with database.atomic():
         unique_users = Trip.select(Trip.user_id).distinct().count()
         active_followings = Trip.select().where(Trip.status == 1).count()
 
-    database.close()
-
     return unique_users, active_followings
 
 
 def delete_record(record_id):
-    database.connect(reuse_if_open=True)
-
     with database.atomic():
         query = Trip.delete().where(Trip.id == record_id)
         query.execute()
 
-    database.close()
+    follow_index.remove(record_id)
@@ -0,0 +1,223 @@
+from array import array
+from bisect import bisect_right
+from threading import Lock
+
+
+def _minutes(time: str) -> int:
+    hours, minutes = time.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def _time(minutes: int) -> str:
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
+
+
+class _Bucket:
+    __slots__ = ('places', 'ids', 'users', 'stations')
+
+    def __init__(self):
+        self.places = array('H')
+        self.ids = array('q')
+        self.users = []
+        self.stations = []  # boarding station of auto-booking follows, None for plain ones
+
+    def add(self, trip_id: int, user_id: str, places: int, station_id):
+        idx = bisect_right(self.places, places)
+        self.places.insert(idx, places)
+        self.ids.insert(idx, trip_id)
+        self.users.insert(idx, user_id)
+        self.stations.insert(idx, station_id)
+        return idx
+
+    def remove(self, trip_id: int):
+        idx = self.ids.index(trip_id)
+        del self.places[idx]
+        del self.ids[idx]
+        del self.users[idx]
+        del self.stations[idx]
+        return idx
+
+    def match(self, free_places: int):
+        idx = bisect_right(self.places, free_places)
+        return [(self.ids[i], self.users[i], self.places[i], self.stations[i]) for i in range(idx)]
+
+
+class _Slot(_Bucket):
+    # window follows overlapping one hour of a route-date, a window is kept in every hour it covers
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self):
+        super().__init__()
+        self.starts = array('H')
+        self.ends = array('H')
+
+    def add(self, trip_id: int, user_id: str, places: int, station_id, start: int = 0, end: int = 0):
+        idx = super().add(trip_id, user_id, places, station_id)
+        self.starts.insert(idx, start)
+        self.ends.insert(idx, end)
+        return idx
+
+    def remove(self, trip_id: int):
+        idx = super().remove(trip_id)
+        del self.starts[idx]
+        del self.ends[idx]
+        return idx
+
+    def match(self, free_places: int, time: int = 0):
+        idx = bisect_right(self.places, free_places)
+        return [(self.ids[i], self.users[i], self.places[i], self.stations[i],
+                 f'{_time(self.starts[i])}-{_time(self.ends[i])}') for i in range(idx)
+                if self.starts[i] <= time <= self.ends[i]]
+
+
+class FollowIndex:
+    __slots__ = ('_buckets', '_slots', '_windows', '_keys', '_dirty', '_lock')
+
+    def __init__(self):
+        self._buckets = {}  # (departure, destination, date, time) -> _Bucket of exact follows
+        self._slots = {}  # (departure, destination, date, hour) -> _Slot of window follows
+        self._windows = {}  # (departure, destination, date) -> {trip id: (start, end)}
+        self._keys = {}
+        self._dirty = {}  # (departure, destination, date) -> windows of follows added since the last match
+        self._lock = Lock()  # written from the database thread, matched from the event loop
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, trip_id, user_id, departure: str, destination: str, date: str, time: str, places, station_id=None,
+            time_to: str = None):
+        with self._lock:
+            self._add(int(trip_id), str(user_id), departure, destination, date, time, time_to or time, int(places),
+                      station_id)
+
+    def _add(self, trip_id: int, user_id: str, departure: str, destination: str, date: str, time: str, time_to: str,
+             places: int, station_id, dirty: bool = True):
+        self._remove(trip_id)
+
+        route = (departure, destination, date)
+
+        if time == time_to:
+            key = route + (time,)
+            bucket = self._buckets.get(key)
+
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket()
+
+            bucket.add(trip_id, user_id, places, station_id)
+            self._keys[trip_id] = (key, None)
+
+        else:
+            start, end = _minutes(time), _minutes(time_to)
+
+            for hour in range(start // 60, end // 60 + 1):
+                slot = self._slots.get(route + (hour,))
+
+                if slot is None:
+                    slot = self._slots[route + (hour,)] = _Slot()
+
+                slot.add(trip_id, user_id, places, station_id, start, end)
+
+            self._windows.setdefault(route, {})[trip_id] = (start, end)
+            self._keys[trip_id] = (route, (start, end))
+
+        if dirty:
+            self._dirty.setdefault(route, set()).add((time, time_to))
+
+    def remove(self, trip_id):
+        with self._lock:
+            self._remove(int(trip_id))
+
+    def _remove(self, trip_id: int):
+        key, window = self._keys.pop(trip_id, (None, None))
+
+        if key is None:
+            return
+
+        if window is None:
+            bucket = self._buckets[key]
+            bucket.remove(trip_id)
+
+            if not bucket.ids:
+                del self._buckets[key]
+
+            return
+
+        start, end = window
+
+        for hour in range(start // 60, end // 60 + 1):
+            slot = self._slots[key + (hour,)]
+            slot.remove(trip_id)
+
+            if not slot.ids:
+                del self._slots[key + (hour,)]
+
+        windows = self._windows[key]
+        del windows[trip_id]
+
+        if not windows:
+            del self._windows[key]
+
+    def match(self, departure: str, destination: str, date: str, time: str, free_places: int):
+        minutes = _minutes(time)
+
+        with self._lock:
+            bucket = self._buckets.get((departure, destination, date, time))
+            slot = self._slots.get((departure, destination, date, minutes // 60))
+
+            result = [] if bucket is None else [m + (time,) for m in bucket.match(free_places)]
+
+            if slot is not None:
+                result += slot.match(free_places, minutes)
+
+            return result
+
+    def take_dirty(self, departure: str, destination: str, date: str):
+        with self._lock:
+            return self._dirty.pop((departure, destination, date), set())
+
+    def routes(self, date_from: str, time_from: str):
+        # earliest followed departure per (date, departure, destination), departed trips and passed windows are skipped
+        result = {}
+        now = _minutes(time_from)
+
+        def earliest(route, time):
+            if route not in result or time < result[route]:
+                result[route] = time
+
+        with self._lock:
+            for departure, destination, date, time in self._buckets:
+                if (date, time) > (date_from, time_from):
+                    earliest((date, departure, destination), time)
+
+            for (departure, destination, date), windows in self._windows.items():
+                if date < date_from:
+                    continue
+
+                starts = [s for s, e in windows.values() if date > date_from or e > now]
+
+                if starts:
+                    earliest((date, departure, destination), _time(min(starts)))
+
+        return result
+
+    def rebuild(self, rows):
+        # markers not yet taken by a match survive, follows the index didn't have are marked as new ones
+        with self._lock:
+            indexed = set(self._keys)
+
+            self._buckets.clear()
+            self._slots.clear()
+            self._windows.clear()
+            self._keys.clear()
+
+            for r in rows:
+                self._add(r.id, str(r.user_id), r.departure, r.destination, r.date, r.time, r.time_to, r.places,
+                          r.station_id, dirty=r.id not in indexed)
+
+            routes = {key[:3] for key, _ in self._keys.values()}
+
+            for route in [r for r in self._dirty if r not in routes]:
+                del self._dirty[route]
+
+
+follow_index = FollowIndex()
@@ -0,0 +1,67 @@
+import logging
+
+from ..utils.dbworker import database
+
+logger = logging.getLogger(__name__)
+
+
+# migrations are frozen SQL: they must not depend on the current state of the models
+def add_trip_indexes():
+    database.execute_sql('CREATE TABLE IF NOT EXISTS "trip" ("id" INTEGER NOT NULL PRIMARY KEY, '
+                         '"user_id" VARCHAR(12) NOT NULL, "departure" VARCHAR(16) NOT NULL, '
+                         '"destination" VARCHAR(16) NOT NULL, "date" DATE NOT NULL, "time" TIME NOT NULL, '
+                         '"places" INTEGER NOT NULL, "status" INTEGER NOT NULL, "created_at" DATETIME NOT NULL, '
+                         '"updated_at" DATETIME NOT NULL)')
+
+    # older databases may hold duplicates that would break the unique index
+    database.execute_sql('DELETE FROM trip WHERE id NOT IN (SELECT MIN(id) FROM trip '
+                         'GROUP BY user_id, departure, destination, date, time, status)')
+
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "trip_status_date_departure_destination_time" '
+                         'ON "trip" ("status", "date", "departure", "destination", "time")')
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "trip_user_id_status_date_time" '
+                         'ON "trip" ("user_id", "status", "date", "time")')
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "trip_date_time" ON "trip" ("date", "time")')
+    database.execute_sql('CREATE UNIQUE INDEX IF NOT EXISTS "trip_user_id_departure_destination_date_time_status" '
+                         'ON "trip" ("user_id", "departure", "destination", "date", "time", "status")')
+
+
+def add_departure_timestamp():
+    database.execute_sql('ALTER TABLE "trip" ADD COLUMN "departs_at" INTEGER NOT NULL DEFAULT 0')
+    database.execute_sql('UPDATE "trip" SET "departs_at" = '
+                         """CAST(strftime('%s', "date" || ' ' || "time") AS INTEGER)""")
+    database.execute_sql('DROP INDEX IF EXISTS "trip_date_time"')
+    database.execute_sql('CREATE INDEX IF NOT EXISTS "trip_departs_at" ON "trip" ("departs_at")')
+
+
+def add_auto_booking_station():
+    database.execute_sql('ALTER TABLE "trip" ADD COLUMN "station_id" INTEGER')
+
+
+def add_follow_time_window():
+    database.execute_sql("""ALTER TABLE "trip" ADD COLUMN "time_to" TIME NOT NULL DEFAULT ''""")
+    database.execute_sql('UPDATE "trip" SET "time_to" = "time"')
+    database.execute_sql('DROP INDEX IF EXISTS "trip_user_id_departure_destination_date_time_status"')
+    database.execute_sql('CREATE UNIQUE INDEX IF NOT EXISTS '
+                         '"trip_user_id_departure_destination_date_time_time_to_status" '
+                         'ON "trip" ("user_id", "departure", "destination", "date", "time", "time_to", "status")')
+
+
+# applied in order, the schema version is kept in PRAGMA user_version; append new migrations only
+migrations = [
+    add_trip_indexes,
+    add_departure_timestamp,
+    add_auto_booking_station,
+    add_follow_time_window,
+]
+
+
+def migrate_database():
+    version = database.pragma('user_version')
+
+    for number, migration in enumerate(migrations[version:], start=version + 1):
+        with database.atomic():
+            migration()
+            database.pragma('user_version', number)
+
+        logger.warning(f'Database migrated to version {number} ({migration.__name__}).')
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+
+from aiogram import Bot
+from aiogram.utils.exceptions import RetryAfter, BadRequest, Unauthorized, TelegramAPIError
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated_at', 'paused_until')
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class NotificationQueue:
+    def __init__(self, bot: Bot, rate: float = 25, chat_interval: float = 1.0, workers: int = 8, retries: int = 3,
+                 size: int = 500):
+        self.bot = bot
+        self.bucket = TokenBucket(rate, rate)
+        self.chat_interval = chat_interval
+        self.workers = workers
+        self.retries = retries
+        self._chat_slots = {}
+        self._queue = asyncio.Queue(maxsize=size)
+        self._workers = []
+        self.delivered = 0
+        self.failed = 0
+
+    async def _wait_chat_slot(self, chat_id):
+        while True:
+            now = time.monotonic()
+            slot = self._chat_slots.get(chat_id, 0.0)
+
+            if slot <= now:
+                self._chat_slots[chat_id] = now + self.chat_interval
+                return
+
+            await asyncio.sleep(slot - now)
+
+    async def _send(self, chat_id, text, reply_markup=None):
+        for attempt in range(1, self.retries + 1):
+            await self._wait_chat_slot(chat_id)
+            await self.bucket.acquire()
+
+            try:
+                await self.bot.send_message(chat_id, text, reply_markup=reply_markup)
+                return True
+
+            except RetryAfter as e:
+                logger.warning(f'Flood control hit while notifying {chat_id}, pausing for {e.timeout} s.')
+                self.bucket.pause(e.timeout)
+
+            except (BadRequest, Unauthorized) as e:
+                logger.warning(f'Unable to notify {chat_id}: {e}')
+                return False
+
+            except (TelegramAPIError, asyncio.TimeoutError) as e:
+                logger.warning(f'Notification to {chat_id} failed (attempt {attempt}/{self.retries}): {e!r}')
+                await asyncio.sleep(attempt)
+
+        return False
+
+    async def _worker(self):
+        while True:
+            chat_id, text, *markup = await self._queue.get()
+
+            try:
+                if await self._send(chat_id, text, *markup):
+                    self.delivered += 1
+                else:
+                    self.failed += 1
+            except Exception:
+                logger.exception(f'Unexpected error while notifying {chat_id}.')
+                self.failed += 1
+            finally:
+                self._queue.task_done()
+
+    def start(self):
+        if not self._workers:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    async def put(self, message):
+        # blocks while the queue is full, so producers slow down to the telegram rate
+        await self._queue.put(message)
+
+    async def join(self):
+        await self._queue.join()
+
+        now = time.monotonic()
+        self._chat_slots = {k: v for k, v in self._chat_slots.items() if v > now}
@@ -0,0 +1,322 @@
+import asyncio
+import datetime
+import logging
+
+from aiogram.dispatcher.storage import BaseStorage
+
+from ..messages.formatter import parse_notification, parse_date_notification, parse_auto_booking, \
+    parse_auto_booking_error
+from ..utils.availability import availability
+from ..utils.data_requests import create_booking
+from ..utils.async_db import get_date_follows, commit_poll_results
+from ..utils.follow_index import follow_index
+from ..utils.date_strings import split_time_window
+from ..utils.notifier import NotificationQueue
+from ..utils.scheduling import PollScheduler, DateFollowScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeTracker:
+    def __init__(self):
+        self._routes = {}  # route -> (payload signature, {trip id: free places})
+
+    def changed_trips(self, route, trips, dirty_windows):
+        # trips worth matching: seats went up, the trip is new, or a follow covering its time was just added
+        signature = hash(tuple((t['id'], t['time'], t['free_places']) for t in trips))
+        previous_signature, previous_places = self._routes.get(route, (None, {}))
+
+        if signature == previous_signature and not dirty_windows:
+            return []
+
+        self._routes[route] = (signature, {t['id']: t['free_places'] for t in trips})
+
+        return [t for t in trips if t['free_places'] > previous_places.get(t['id'], -1)
+                or any(start <= t['time'] <= end for start, end in dirty_windows)]
+
+    def retain(self, routes):
+        for route in [r for r in self._routes if r not in routes]:
+            del self._routes[route]
+
+
+trip_changes = ChangeTracker()
+
+
+async def fetch_routes(routes, concurrency: int, snapshot_ttl: float, skip=None):
+    semaphore = asyncio.Semaphore(concurrency)
+    availability.prune()
+
+    async def fetch(route):
+        async with semaphore:
+            try:
+                return route, await availability.get_trips(*route, max_age=snapshot_ttl, skip=skip)
+            except Exception:
+                logger.exception(f'Unable to fetch trips of {route}.')
+                return route, None
+
+    for task in asyncio.as_completed([fetch(r) for r in routes]):
+        yield await task
+
+
+class DatePoller:
+    def __init__(self, notifier: NotificationQueue, scheduler: DateFollowScheduler, concurrency: int,
+                 snapshot_ttl: float):
+        self.notifier = notifier
+        self.scheduler = scheduler
+        self.concurrency = concurrency
+        self.snapshot_ttl = snapshot_ttl
+        self._followers = {}  # (date, departure, destination) -> user ids, as read at the last cycle
+        self._fired = set()  # fired routes the database may still list as followed
+        self._tasks = set()
+
+    def _take(self, route):
+        users = self._followers.pop(route, None)
+
+        if users is not None:
+            self._fired.add(route)
+
+        return users
+
+    async def _fire(self, fired):
+        # fired: (date, departure, destination) -> user ids
+        if not fired:
+            return
+
+        try:
+            await commit_poll_results(fired_dates=list(fired))
+
+        except Exception:
+            logger.exception(f'Unable to close {len(fired)} fired date followings.')
+
+            # the follows are still in the database, they fire again once the date is seen open
+            for route, users in fired.items():
+                self._fired.discard(route)
+                self._followers.setdefault(route, users)
+
+            return
+
+        for route, users in fired.items():
+            self.scheduler.opened(route)
+
+            for user_id in users:
+                await self.notifier.put((user_id, parse_date_notification(*route)))
+
+    def _task_done(self, task):
+        self._tasks.discard(task)
+
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Date following task failed.', exc_info=task.exception())
+
+    def publish(self, route, trips):
+        # any search that sees the date open fires its follows without waiting for the next poll
+        if not trips or route not in self._followers:
+            return
+
+        task = asyncio.create_task(self._fire({route: self._take(route)}))
+        self._tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    async def run_cycle(self):
+        self.notifier.start()
+        followers = {}
+
+        for item in await get_date_follows():
+            followers.setdefault((item.date, item.departure, item.destination), []).append(item.user_id)
+
+        # a route stays fired until its follows are no longer read back from the database
+        self._fired = {r for r in self._fired if r in followers}
+        self._followers = {r: users for r, users in followers.items() if r not in self._fired}
+        self.scheduler.sync(self._followers)
+
+        # near the expected opening dates are polled every tick, so the snapshot must not be older than that
+        max_age = min(self.snapshot_ttl, self.scheduler.tick_seconds / 2)
+        fired = {}
+
+        async for route, trips in fetch_routes(self.scheduler.due(), self.concurrency, max_age, self.publish):
+            if not trips:
+                self.scheduler.reschedule(route, trips)
+                continue
+
+            if route in self._followers:
+                fired[route] = self._take(route)
+
+        await self._fire(fired)
+
+
+class TripPoller:
+    # fetch -> match -> mark -> deliver, every stage is a long-lived task fed through a bounded queue,
+    # so the first freed seat reaches the user while the rest of the routes are still being fetched
+    def __init__(self, notifier: NotificationQueue, scheduler: PollScheduler, concurrency: int,
+                 queue_size: int = 100, batch_size: int = 100, storage: BaseStorage = None):
+        self.notifier = notifier
+        self.storage = storage  # FSM storage, keeps the token and the last name of auto-booking users
+        self.scheduler = scheduler
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self._fetched = asyncio.Queue(maxsize=queue_size)  # (route, trips)
+        self._matched = asyncio.Queue(maxsize=queue_size)  # (follow id, match)
+        self._cycle = asyncio.Lock()
+        self._tasks = []
+        self._bookings = set()
+        self.matched = 0
+
+    def start(self):
+        self.notifier.start()
+
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._match_stage()), asyncio.create_task(self._mark_stage())]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _match_stage(self):
+        while True:
+            route, trips = await self._fetched.get()
+
+            try:
+                await self._match(route, trips)
+            except Exception:
+                logger.exception(f'Unable to match followings for {route}.')
+            finally:
+                self._fetched.task_done()
+
+    async def _match(self, route, trips):
+        date, departure, destination = route
+
+        for trip in trip_changes.changed_trips(route, trips, follow_index.take_dirty(departure, destination, date)):
+            concurrences = follow_index.match(departure, destination, trip['date'], trip['time'],
+                                              trip['free_places'])
+
+            for follow_id, user_id, places, station_id, window in concurrences:
+                # another car in the window must not match this follow again
+                follow_index.remove(follow_id)
+                self.matched += 1
+
+                await self._matched.put((follow_id, (user_id, departure, destination, trip, places, station_id,
+                                                     window)))
+
+    async def _auto_book(self, user_id, departure, destination, trip, places, station_id, window):
+        text, keyboard = parse_notification(departure, destination, trip['date'], trip['time'], places, trip['id'],
+                                            window)
+
+        try:
+            user_data = {} if self.storage is None else await self.storage.get_data(chat=user_id, user=user_id)
+
+            if 'token' not in user_data:
+                booking_data = {'status': 'false', 'error': 'Для автобронирования необходимо авторизоваться в личном '
+                                                            'кабинете (/account).'}
+            else:
+                booking_data = await create_booking(user_data['token'], departure, destination, trip['date'],
+                                                    trip['time'], places, trip['id'], station_id,
+                                                    fio=user_data.get('fio'))
+        except Exception:
+            logger.exception(f'Unable to auto-book trip {trip["id"]} for {user_id}.')
+            booking_data = None
+
+        if booking_data is None:
+            await self.notifier.put((user_id, parse_auto_booking_error('Сервер не ответил.', text), keyboard))
+
+        elif booking_data['status'] == 'false':
+            await self.notifier.put((user_id, parse_auto_booking_error(booking_data['error'], text), keyboard))
+
+        else:
+            await self.notifier.put((user_id, parse_auto_booking(departure, destination, trip['date'], trip['time'],
+                                                                 places)))
+
+    async def _dispatch(self, user_id, departure, destination, trip, places, station_id, window):
+        if station_id is None:
+            await self.notifier.put((user_id, *parse_notification(departure, destination, trip['date'], trip['time'],
+                                                                  places, trip['id'], window)))
+            return
+
+        # booking must not hold up the notifications queued behind it
+        task = asyncio.create_task(self._auto_book(user_id, departure, destination, trip, places, station_id,
+                                                   window))
+        self._bookings.add(task)
+        task.add_done_callback(self._bookings.discard)
+
+    def publish(self, route, trips):
+        # trips downloaded by anyone's search are matched at once, the next poll catches whatever is dropped here
+        if route not in self.scheduler:
+            return
+
+        try:
+            self._fetched.put_nowait((route, trips))
+        except asyncio.QueueFull:
+            pass
+
+    async def _mark_stage(self):
+        while True:
+            batch = [await self._matched.get()]
+
+            while len(batch) < self.batch_size and not self._matched.empty():
+                batch.append(self._matched.get_nowait())
+
+            try:
+                # the follows are closed before the messages go out, a crash must not notify twice
+                await commit_poll_results(closed_ids=[follow_id for follow_id, _ in batch])
+
+            except Exception:
+                logger.exception(f'Unable to close {len(batch)} matched followings.')
+                self._restore(batch)
+
+            else:
+                for _, match in batch:
+                    try:
+                        await self._dispatch(*match)
+                    except Exception:
+                        logger.exception(f'Unable to notify {match[0]} about a matched following.')
+
+            finally:
+                for _ in batch:
+                    self._matched.task_done()
+
+    def _restore(self, batch):
+        # the follows are still active in the database, put them back to be matched again
+        for follow_id, (user_id, departure, destination, trip, places, station_id, window) in batch:
+            time, time_to = split_time_window(window)
+            follow_index.add(follow_id, user_id, departure, destination, trip['date'], time, places, station_id,
+                             time_to)
+
+    async def run_cycle(self):
+        if self._cycle.locked():
+            logger.info('Previous polling cycle is still running, skipping.')
+            return
+
+        async with self._cycle:
+            self.start()
+            matched, delivered, failed = self.matched, self.notifier.delivered, self.notifier.failed
+
+            now = datetime.datetime.now()
+            self.scheduler.sync(follow_index.routes(now.strftime('%Y-%m-%d'), now.strftime('%H:%M')))
+            routes = self.scheduler.due()
+            pending = set(routes)
+
+            try:
+                async for route, trips in fetch_routes(routes, self.concurrency, self.scheduler.min_interval,
+                                                       self.publish):
+                    pending.discard(route)
+                    self.scheduler.reschedule(route, trips)
+
+                    if trips is not None:
+                        await self._fetched.put((route, trips))
+
+            finally:
+                # due() popped these routes off the schedule, an aborted cycle must put them back
+                for route in pending:
+                    self.scheduler.reschedule(route, None)
+
+            # delivery isn't awaited, the bounded notifier queue already holds matching back when it falls behind
+            await self._fetched.join()
+            await self._matched.join()
+
+            trip_changes.retain(self.scheduler)
+
+            if routes:
+                logger.info(f'Polled {len(routes)} of {len(self.scheduler)} routes, '
+                            f'{self.matched - matched} followings matched, {self.notifier.delivered - delivered} '
+                            f'notifications delivered and {self.notifier.failed - failed} failed meanwhile.')
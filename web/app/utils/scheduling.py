@@ -0,0 +1,209 @@
+import heapq
+import time
+
+from ..utils.date_strings import departure_timestamp, current_timestamp
+
+
+class _RouteState:
+    __slots__ = ('next_poll', 'departure_time', 'departs_at', 'churn', 'signature')
+
+    def __init__(self, departure_time: str, departs_at: int):
+        self.next_poll = time.monotonic()
+        self.departure_time = departure_time
+        self.departs_at = departs_at
+        self.churn = 0.0
+        self.signature = None
+
+
+class PollScheduler:
+    def __init__(self, min_interval: float = 15, max_interval: float = 1800, budget: float = 60):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.budget = budget  # upstream requests per minute
+        self._routes = {}
+        self._queue = []
+        self._allowance = budget
+        self._updated_at = time.monotonic()
+
+    def __len__(self):
+        return len(self._routes)
+
+    def __contains__(self, route):
+        return route in self._routes
+
+    def sync(self, routes):
+        # routes: (date, departure, destination) -> earliest followed departure time on that date
+        for route in [r for r in self._routes if r not in routes]:
+            del self._routes[route]
+
+        for route, departure_time in routes.items():
+            state = self._routes.get(route)
+
+            if state is None:
+                state = self._routes[route] = _RouteState(departure_time, departure_timestamp(route[0], departure_time))
+                heapq.heappush(self._queue, (state.next_poll, route))
+
+            elif state.departure_time != departure_time:
+                state.departure_time = departure_time
+                state.departs_at = departure_timestamp(route[0], departure_time)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._allowance = min(self.budget, self._allowance + (now - self._updated_at) * self.budget / 60)
+        self._updated_at = now
+        return now
+
+    def take(self, reserve: float = 0) -> bool:
+        # other upstream work (the cache warmer) spends the same budget, leaving reserve requests to the polls
+        self._refill()
+
+        if self._allowance < 1 + reserve:
+            return False
+
+        self._allowance -= 1
+        return True
+
+    def due(self):
+        now = self._refill()
+        routes = []
+
+        while self._queue and self._queue[0][0] <= now and self._allowance >= 1:
+            next_poll, route = heapq.heappop(self._queue)
+            state = self._routes.get(route)
+
+            # entries of dropped or already rescheduled routes are skipped lazily
+            if state is None or state.next_poll != next_poll:
+                continue
+
+            routes.append(route)
+            self._allowance -= 1
+
+        return routes
+
+    def interval(self, route) -> float:
+        state = self._routes[route]
+
+        # a minute per 40 minutes left before departure, up to three times faster on routes with frequent changes
+        interval = min(self.max_interval, max(self.min_interval, (state.departs_at - current_timestamp()) / 40))
+        return max(self.min_interval, interval / (1 + 2 * state.churn))
+
+    def reschedule(self, route, trips):
+        state = self._routes.get(route)
+
+        if state is None:
+            return
+
+        if trips is not None:
+            signature = hash(tuple((t['id'], t['free_places']) for t in trips))
+            changed = state.signature is not None and signature != state.signature
+            state.churn = state.churn * 0.7 + (0.3 if changed else 0)
+            state.signature = signature
+
+        state.next_poll = time.monotonic() + self.interval(route)
+        heapq.heappush(self._queue, (state.next_poll, route))
+
+
+class TimingWheel:
+    def __init__(self, size: int = 60):
+        self.size = size
+        self.tick = 0
+        self._slots = [{} for _ in range(size)]  # item -> remaining rounds
+        self._positions = {}
+
+    def __contains__(self, item):
+        return item in self._positions
+
+    def __iter__(self):
+        return iter(list(self._positions))
+
+    def schedule(self, item, delay: int):
+        self.cancel(item)
+        delay = max(1, delay)
+        slot = (self.tick + delay) % self.size
+
+        self._slots[slot][item] = (delay - 1) // self.size
+        self._positions[item] = slot
+
+    def cancel(self, item):
+        slot = self._positions.pop(item, None)
+
+        if slot is not None:
+            del self._slots[slot][item]
+
+    def advance(self):
+        self.tick += 1
+        slot = self._slots[self.tick % self.size]
+        due = [item for item, rounds in slot.items() if rounds == 0]
+
+        for item in due:
+            del slot[item]
+            del self._positions[item]
+
+        for item in slot:
+            slot[item] -= 1
+
+        return due
+
+
+class DateFollowScheduler:
+    tick_seconds = 60
+
+    def __init__(self, horizon_days: float = 10, lead_minutes: int = 60, late_interval: int = 10,
+                 max_delay: int = 30):
+        self.horizon = horizon_days * 86400  # learned from observed openings, seconds before the day starts
+        self.lead = lead_minutes
+        self.late_interval = late_interval
+        self.max_delay = max_delay
+        self._wheel = TimingWheel()
+        self._started_at = time.monotonic()
+        self._seen_empty = set()
+
+    def _opens_in(self, date: str) -> float:
+        # minutes until the expected opening of booking on the date
+        return (departure_timestamp(date, '00:00') - self.horizon - current_timestamp()) / 60
+
+    def _delay(self, date: str) -> int:
+        opens_in = self._opens_in(date)
+
+        # far dates still get a sparse poll: booking may open earlier than expected, and only a poll
+        # that sees it open early lets the horizon learn that
+        if opens_in > self.lead:
+            return int(min(opens_in - self.lead, self.max_delay))
+
+        if opens_in > -self.lead:
+            return 1
+
+        return self.late_interval
+
+    def sync(self, routes):
+        for route in routes:
+            if route not in self._wheel:
+                self._wheel.schedule(route, 1)  # new follows are checked once right away
+
+        for route in [r for r in self._wheel if r not in routes]:
+            self._wheel.cancel(route)
+            self._seen_empty.discard(route)
+
+    def due(self):
+        due = []
+        target = int((time.monotonic() - self._started_at) // self.tick_seconds)
+
+        while self._wheel.tick < target:
+            due.extend(self._wheel.advance())
+
+        return due
+
+    def reschedule(self, route, trips):
+        if trips is not None:
+            self._seen_empty.add(route)
+
+        self._wheel.schedule(route, self._delay(route[0]))
+
+    def opened(self, route):
+        # only an empty -> open transition we have witnessed tells when booking really opens
+        if route in self._seen_empty:
+            observed = departure_timestamp(route[0], '00:00') - current_timestamp()
+            self.horizon = self.horizon * 0.7 + observed * 0.3
+            self._seen_empty.discard(route)
+
+        self._wheel.cancel(route)
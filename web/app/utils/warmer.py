@@ -0,0 +1,34 @@
+import asyncio
+import datetime
+import logging
+
+from ..utils.async_db import get_popular_routes
+from ..utils.availability import availability
+from ..utils.scheduling import PollScheduler
+
+logger = logging.getLogger(__name__)
+
+
+async def warm_cache(budget: PollScheduler, routes: int, days: int, pace: float, max_age: float):
+    scores = dict(availability.demand)
+
+    for departure, destination, follows in await get_popular_routes(routes):
+        scores[(departure, destination)] = scores.get((departure, destination), 0) + follows
+
+    popular = sorted(scores, key=scores.get, reverse=True)[:routes]
+    dates = [(datetime.date.today() + datetime.timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    stale = [(date, departure, destination) for departure, destination in popular for date in dates
+             if not availability.is_fresh(date, departure, destination, max_age)]
+    warmed = 0
+
+    for date, departure, destination in stale:
+        # half of the upstream budget stays with the followers' polls
+        if not budget.take(reserve=budget.budget / 2):
+            break
+
+        await availability.refresh(date, departure, destination)
+        await asyncio.sleep(pace)
+        warmed += 1
+
+    availability.decay_demand()
+    logger.info(f'Cache warmer refreshed {warmed} route-dates, hit ratio {availability.hit_ratio:.0%}.')
@@ -9,7 +9,16 @@ from app.utils.config_reader import load_config
 from app.handlers.common import register_handlers_common, register_default_handler, register_stats_handler
 from app.handlers.trip_search import register_handlers_trip_search, register_commands_trip_search
 from app.handlers.cabinet import register_handlers_cabinet, register_commands_cabinet
-from app.utils.dbworker import check_trips, clear_trips, check_dates
+from app.handlers.inline import register_handlers_inline
+from app.utils.async_db import run_db, clear_trips, load_follow_index, connect_database, shutdown as shutdown_db
+from app.utils.migrations import migrate_database
+from app.utils.poller import TripPoller, DatePoller
+from app.utils.scheduling import PollScheduler, DateFollowScheduler
+from app.utils.notifier import NotificationQueue
+from app.utils.catalog import routes, station_catalog
+from app.utils.availability import availability
+from app.utils.warmer import warm_cache
+from app.utils.data_requests import close_session
 from config.storage import storage
 
 logger = logging.getLogger(__name__)
@@ -25,20 +34,6 @@ async def set_commands(bot: Bot):
     await bot.set_my_commands(commands)
 
 
-async def send_notifications(bot: Bot):
-    messages = check_trips()
-
-    for m in messages:
-        await bot.send_message(m[0], m[1], reply_markup=m[2])
-
-
-async def check_following_dates(bot: Bot):
-    messages = check_dates()
-
-    for m in messages:
-        await bot.send_message(m[0], m[1])
-
-
 async def main():
     logging.basicConfig(filename='log.txt', level=logging.WARN, filemode='a',
                         format="%(asctime)s - %(levelname)s - %(name)s - %(message)s")
@@ -52,6 +47,16 @@ async def main():
 
     await set_commands(bot)
 
+    await connect_database()
+    await run_db(migrate_database)
+    await load_follow_index()
+
+    routes.ttl = config.catalog.routes_ttl
+    station_catalog.ttl = config.catalog.stations_ttl
+    availability.search_ttl = config.search.snapshot_ttl
+    availability.stale_limit = config.search.stale_limit
+    await routes.refresh()
+
     register_commands_trip_search(dp)
     register_commands_cabinet(dp)
 
@@ -60,17 +65,48 @@ async def main():
     register_handlers_common(dp)
     register_handlers_trip_search(dp)
     register_handlers_cabinet(dp)
+    register_handlers_inline(dp, config.search.inline_cache_time)
 
     register_default_handler(dp)
 
+    notifier = NotificationQueue(bot, rate=config.notifier.rate, workers=config.notifier.workers,
+                                 retries=config.notifier.retries)
+
+    poll_scheduler = PollScheduler(min_interval=config.poller.min_interval, max_interval=config.poller.max_interval,
+                                   budget=config.poller.budget)
+
+    trip_poller = TripPoller(notifier, poll_scheduler, config.poller.concurrency, queue_size=config.poller.queue_size,
+                             storage=dp.storage)
+
+    date_scheduler = DateFollowScheduler(horizon_days=config.dates.horizon_days,
+                                         lead_minutes=config.dates.lead_minutes,
+                                         late_interval=config.dates.late_interval,
+                                         max_delay=config.dates.max_delay)
+
+    date_poller = DatePoller(notifier, date_scheduler, config.poller.concurrency, config.poller.snapshot_ttl)
+
+    availability.subscribe(trip_poller.publish)
+    availability.subscribe(date_poller.publish)
+
     scheduler = AsyncIOScheduler()
-    scheduler.add_job(send_notifications, 'interval', (bot,), minutes=3)
-    scheduler.add_job(check_following_dates, 'cron', (bot,), minute='5,35', misfire_grace_time=None)
+    # an overlapping tick gets through to run_cycle, which skips it while the previous cycle holds the lock
+    scheduler.add_job(trip_poller.run_cycle, 'interval', seconds=config.poller.tick, max_instances=2, coalesce=True)
+    scheduler.add_job(date_poller.run_cycle, 'interval', minutes=1)
     scheduler.add_job(clear_trips, 'cron', minute=4, misfire_grace_time=None)
+    scheduler.add_job(warm_cache, 'interval', (poll_scheduler, config.warmer.routes, config.warmer.days,
+                                               config.warmer.pace, config.warmer.max_age),
+                      seconds=config.warmer.interval, max_instances=1, coalesce=True)
 
+    trip_poller.start()
     scheduler.start()
 
-    await dp.start_polling()
+    try:
+        await dp.start_polling()
+    finally:
+        await trip_poller.stop()
+        await notifier.stop()
+        await close_session()
+        await shutdown_db()
 
 
 if __name__ == '__main__':